@@ -1,12 +1,179 @@
-from pyroDB import PickleTable
+from pyroDB import PickleTable, PickleCatalog
 
 import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-os.makedirs('../data/tmp', exist_ok=True)
-os.makedirs('../data/csv_data', exist_ok=True)
+DATA = '../data'
+OUT = '../data/tmp'
+MANIFEST = OUT + '/export_manifest.json' # output file -> signature of the table it was made from
 
-for file in os.scandir('../data'):
-	if file.path.endswith('.pdb'):
-		print(file.path)
-		db = PickleTable(file.path)
-		db.to_csv('../data/tmp/'+file.name.rsplit('.', 1)[0]+'.csv')
\ No newline at end of file
+ACCOUNT_KINDS = ('_time', '_active_vid') # <email>, <email>_time, <email>_active_vid
+
+
+def file_sig(path):
+	'''mtime of a db file and its wal, changes whenever the data does'''
+	sig = [os.stat(path).st_mtime_ns]
+	if os.path.exists(path+'.wal'):
+		sig.append(os.stat(path+'.wal').st_mtime_ns)
+	return sig
+
+def account_of(name):
+	'''(email, kind) of a per-account table name, None if it is not one'''
+	for kind in ACCOUNT_KINDS:
+		if name.endswith(kind):
+			name = name[:-len(kind)]
+			break
+	else:
+		kind = ''
+	return (name, kind) if '@' in name else None
+
+def open_table(path, name):
+	# no mmap: on windows a mapped file can't be replaced, main.py's dumps would fail while we export
+	opts = dict(use_mmap=False, file_lock=True, sig=False, rescan_policy='never')
+	if name is None:
+		return PickleTable(path, **opts)
+	return PickleCatalog(path, **opts).table(name)
+
+def export(table, path, fmt):
+	if fmt == 'csv':
+		table.to_csv(path)
+	elif fmt == 'parquet':
+		table.to_parquet(path)
+	elif fmt == 'arrow':
+		table.to_arrow(path)
+	else:
+		table.to_ndjson(path)
+
+def convert(path, name, out, fmt):
+	'''Export one table (runs in a worker process), returns (rows, bytes written)'''
+	table = open_table(path, name)
+	export(table, out, fmt)
+	return table.height, os.path.getsize(out)
+
+def read_columns(path, name):
+	'''Columns of one table as {column: (dtype, list)} (runs in a worker process, for --merge)'''
+	table = open_table(path, name)
+	return {c: (table.dtype(c), list(table.column(c))) for c in table.column_names}
+
+def tables():
+	'''(db file, table name or None, output name, signature) of every table in ../data'''
+	for file in sorted(os.scandir(DATA), key=lambda f: f.name):
+		if not file.name.endswith('.pdb'):
+			continue
+		if PickleCatalog.is_catalog(file.path): # one output per table
+			# every account shares the file, its mtime changes on any write: sign each table by its data
+			catalog = PickleCatalog(file.path, file_lock=True, sig=False, rescan_policy='never') # not half written
+			for name, digest in catalog.digests().items():
+				yield file.path, name, name, digest
+		else:
+			yield file.path, None, file.name.rsplit('.', 1)[0], file_sig(file.path)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Export every .pdb table in ../data")
+	parser.add_argument('--format', choices=('csv', 'parquet', 'arrow', 'ndjson'), default='csv',
+		help="parquet and arrow need pyarrow")
+	parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="worker processes")
+	parser.add_argument('--force', action='store_true', help="export even the tables that did not change")
+	parser.add_argument('--merge', action='store_true',
+		help="also write all_<kind> files with the tables of every account and an 'account' column")
+	args = parser.parse_args()
+
+	os.makedirs(OUT, exist_ok=True)
+	os.makedirs('../data/csv_data', exist_ok=True)
+
+	try:
+		with open(MANIFEST) as f:
+			manifest = json.load(f)
+	except (FileNotFoundError, ValueError):
+		manifest = {}
+
+	st = time.perf_counter()
+	todo = []
+	skipped = 0
+	found = list(tables())
+	for path, name, out_name, sig in found:
+		out = OUT+'/'+out_name+'.'+args.format
+		if not args.force and manifest.get(out) == sig and os.path.exists(out):
+			skipped += 1
+			continue
+		todo.append((path, name, out, sig))
+
+	rows = size = 0
+	failed = []
+	with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+		jobs = {pool.submit(convert, path, name, out, args.format): (out, sig) for path, name, out, sig in todo}
+
+		merge = []
+		merged_out = lambda kind: OUT+'/all'+(kind or '_videos')+'.'+args.format
+		kinds = {account[1] for account in map(account_of, (out_name for _, _, out_name, _ in found)) if account}
+		stale = any(account_of(os.path.basename(out).rsplit('.', 1)[0]) for _, _, out, _ in todo) \
+			or not all(os.path.exists(merged_out(kind)) for kind in kinds)
+		if args.merge and stale: # merged files are rebuilt whole, only when an account changed
+			for path, name, out_name, _ in found:
+				account = account_of(out_name)
+				if account:
+					merge.append((account, pool.submit(read_columns, path, name)))
+
+		for job, (out, sig) in jobs.items():
+			try:
+				n, written = job.result()
+			except Exception as e:
+				failed.append(out)
+				print(f"{out}: {e!r}", file=sys.stderr)
+				continue
+			print(out)
+			rows += n
+			size += written
+			manifest[out] = sig
+
+		exported = len(todo) - len(failed)
+		merged = {} # kind -> table
+		broken = set() # kinds missing an account, not exported
+		for (email, kind), job in merge:
+			try:
+				columns = job.result()
+			except Exception as e: # the other kinds are still merged, the manifest still saved
+				broken.add(kind)
+				print(f"{merged_out(kind)} ({email}): {e!r}", file=sys.stderr)
+				continue
+			table = merged.get(kind)
+			if table is None:
+				table = merged[kind] = PickleTable('', auto_dump=False, sig=False)
+				table.add_column('account', AD=False)
+			for c, (dtype, values) in columns.items(): # keeps "ts" columns dates in the export
+				table.add_column(c, exist_ok=True, AD=False, dtype=dtype)
+			height = len(next(iter(columns.values()))[1]) if columns else 0
+			table.add_rows_columnar({'account': [email] * height, **{c: values for c, (dtype, values) in columns.items()}}, AD=False)
+
+	for kind in broken: # a partial file would look up to date: rebuilt on the next run
+		merged.pop(kind, None)
+		failed.append(merged_out(kind))
+		if os.path.exists(merged_out(kind)):
+			os.remove(merged_out(kind))
+	for kind, table in merged.items():
+		out = merged_out(kind)
+		try:
+			export(table, out, args.format)
+		except Exception as e:
+			failed.append(out)
+			print(f"{out}: {e!r}", file=sys.stderr)
+			continue
+		print(out)
+		rows += table.height
+		size += os.path.getsize(out)
+
+	with open(MANIFEST, 'w') as f:
+		json.dump(manifest, f, indent=1)
+
+	took = time.perf_counter() - st
+	print(f"\n{exported} exported, {skipped} unchanged, {len(failed)} failed"
+		f" | {rows} rows, {size/1e6:.2f}MB in {took:.2f}s ({rows/took:.0f} rows/s, {size/1e6/took:.2f}MB/s)")
+
+
+if __name__ == '__main__':
+	main()
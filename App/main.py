@@ -8,7 +8,7 @@ from pytz import timezone
 
 from print_text3 import xprint
 
-from pyroDB import PickleTable
+from pyroDB import PickleTable, PickleCatalog
 
 from tiktok_uploader_2.upload import upload_video, upload_videos, waste_time, get_authentic_driver, follow_back_all, delete_low_videos
 from tiktok_uploader_2.auth import InsufficientAuth
@@ -43,15 +43,35 @@ def dt_now():
 def dt_to_timestamp(dt):
 	return datetime.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S").timestamp()
 
+def export_on_change(table, path):
+	'''keep a csv copy of the table, rewritten (incrementally, in the background) after every change'''
+	table.export_csv(path)
+	table.on_change(lambda changes: table.export_csv(path))
+
 
 all_users = PickleTable('../data/users.pdb')
 all_user_names = all_users.get_column('TT_username')
 
 all_user_names = [name for name in all_user_names if name is not None]
 
-users = PickleTable('../data/bot_users.pdb')
+# every bot table (users, and the video/time tables of each account) lives in one file
+accounts = PickleCatalog('../data/accounts.pdb', wal=True, rescan_policy='inotify', file_lock=True, durability='file')
+
+def account_table(name):
+	'''Table `name` of the accounts catalog, imported from the old ../data/<name>.pdb file the first time'''
+	legacy = '../data/'+name+'.pdb'
+	if name not in accounts and os.path.exists(legacy):
+		accounts.import_file(legacy, name)
+		# keep the old file around, but out of the way of DB_to_CSV
+		os.replace(legacy, legacy+'.imported')
+		if os.path.exists(legacy+'.wal'):
+			os.replace(legacy+'.wal', legacy+'.wal.imported')
+	return accounts.table(name)
+
+users = account_table('bot_users')
 users.add_column('email', exist_ok=True)
 users.add_column('cookies', exist_ok=True)
+users.create_index('email')
 
 class UserHandler:
 	def __init__(self):
@@ -61,16 +81,17 @@ class UserHandler:
 		self.update_cookies()
 		self.user_dbs = {}
 	def update_cookies(self):
-		for file in os.listdir('../cookies'):
-			if file.endswith('.cookie'):
-				email = file.rsplit('.', 1)[0]
-				if email in self.users.get_column('email'):
-					continue
-				cookies = '../cookies/'+file
-				self.users.add_row({'email':email, "cookies":cookies})
+		with self.users.batch(): # one dump for all new cookies
+			for file in os.listdir('../cookies'):
+				if file.endswith('.cookie'):
+					email = file.rsplit('.', 1)[0]
+					if self.users.find_1st(email, 'email', full_match=True):
+						continue
+					cookies = '../cookies/'+file
+					self.users.add_row({'email':email, "cookies":cookies})
 
 	def cookie(self, email):
-		cell = self.users.find_1st(email, 'email')
+		cell = self.users.find_1st(email, 'email', full_match=True)
 
 		return cell.row_obj()['cookies'] if cell else None
 	
@@ -92,20 +113,24 @@ class User:
 		self.cookies:str = handler.cookie(email)
 		self.driver = None
 
-		self.db = PickleTable('../data/'+email+'.pdb')
-		self.db.add_column('video', 'post_date', exist_ok=True)
+		self.db = account_table(email)
+		self.db.add_column('video', exist_ok=True)
+		self.db.add_column('post_date', exist_ok=True, dtype='ts') # converts the old date strings
+		self.uploads = self.db.create_rollup('post_date') # videos per day
 
-		self.db.to_csv('../data/csv/'+self.email+'.csv')
+		export_on_change(self.db, '../data/csv/'+self.email+'.csv')
 
 
 
-		self.tdb = PickleTable('../data/'+email+'_time.pdb')
-		self.tdb.add_column('login', 'active_time', exist_ok=True)
+		self.tdb = account_table(email+'_time')
+		self.tdb.add_column('login', exist_ok=True, dtype='ts') # day index for "today" lookups
+		self.tdb.add_column('active_time', dtype='f8', exist_ok=True)
+		self.activity = self.tdb.create_rollup('login', 'active_time') # logins and time spent per day
 
-		self.tdb.to_csv('../data/csv/'+self.email+'_time.csv')
+		export_on_change(self.tdb, '../data/csv/'+self.email+'_time.csv')
 
-		self.active_videos = PickleTable('../data/'+email+'_active_vid.pdb')
-		self.active_videos.add_column('video', exist_ok=True)
+		self.active_videos = account_table(email+'_active_vid')
+		self.active_videos.add_column('video', exist_ok=True, dtype='category')
 
 
 		self.search_terms = []
@@ -124,31 +149,15 @@ class User:
 
 	def is_active_5_days(self):
 		# check if user has already logged in for 5 days
-		logins = self.tdb.get_column('login')
-		days = []
-		for login in logins:
-			day = login.split(' ')[0] # get date
-			if day not in days:
-				days.append(day)
-			if len(days) >= 5:
-				return True
-			
-		return False
+		return len(self.activity) >= 5
 	
 
 	def is_warmed_up(self):
 		"""
 		Check if user has already spent 4 hours on tiktok
 		"""
-		# time_spent = sum(self.tdb.get_column('active_time'))
-		# return time_spent > 4*60*60
-
-		time_spent = 0
-		for cell in self.tdb.get_column('active_time'):
-			time_spent += cell
-			if time_spent > 4*60*60:
-				return True and self.is_active_5_days()
-		return False
+		time_spent = self.activity.total()['active_time']
+		return time_spent > 4*60*60 and self.is_active_5_days()
 
 			
 
@@ -157,11 +166,7 @@ class User:
 		"""
 		Time spent today
 		"""
-		time_spent = 0
-		for row in self.tdb.rows():
-			time_spent += row['active_time'] if row['login'].split(' ')[0] == dt_now().split(' ')[0] else 0
-
-		return time_spent
+		return self.activity.day()['active_time']
 
 
 
@@ -174,9 +179,7 @@ class User:
 		
 		
 		# check usage today (if user has already spent .5 hours today)
-		time_spent = 0
-		for row in self.tdb.rows():
-			time_spent += row['active_time'] if row['login'].split(' ')[0] == dt_now().split(' ')[0] else 0
+		time_spent = self.active_time_today()
 
 		if time_spent > 0.8 * 3600:
 			return None
@@ -197,9 +200,8 @@ class User:
 		
 		search_terms = random.sample(self.search_terms, random.randint(3,7))
 
-		row = self.tdb.add_row({'login':dt_now(), 'active_time':0})
+		row = self.tdb.add_row({'login':time.time(), 'active_time':0})
 
-		self.tdb.to_csv('../data/csv/'+self.email+'_time.csv')
 
 		waste_time_start = time.time()
 		
@@ -217,7 +219,6 @@ class User:
 			xprint('/rh/', traceback.format_exc(), '/=/')
 		
 		row.update({'active_time':time.time() - waste_time_start})
-		self.tdb.to_csv('../data/csv/'+self.email+'_time.csv')
 
 
 
@@ -240,9 +241,8 @@ class User:
 
 		xprint('>> /y/', f'[{self.email}]/=/ Light Warming up for /y/{to_waste/60:.2f} minutes', '/=/')
 
-		row = self.tdb.add_row({'login':dt_now(), 'active_time':0})
+		row = self.tdb.add_row({'login':time.time(), 'active_time':0})
 
-		self.tdb.to_csv('../data/csv/'+self.email+'_time.csv')
 		
 		search_terms = random.sample(self.search_terms, random.randint(3,7))
 
@@ -265,7 +265,6 @@ class User:
 		
 		row.update({'active_time':time.time() - time_waste_start})
 
-		self.tdb.to_csv('../data/csv/'+self.email+'_time.csv')
 
 		xprint('>> /y/', f'[{self.email}]/=/ Light Warmed up for /y/{row["active_time"]/60:.2f} minutes', '/=/')
 		
@@ -280,9 +279,8 @@ class User:
 		waste_before = 30 ##(random.randint(10, 15) + random.random()) * 60
 		waste_after = 30 #(random.randint(5, 10) + random.random()) * 60
 
-		tdr = self.tdb.add_row({'login':dt_now(), 'active_time':0})
+		tdr = self.tdb.add_row({'login':time.time(), 'active_time':0})
 
-		self.tdb.to_csv('../data/csv/'+self.email+'_time.csv')
 		
 		upload_time_start = time.time()
 
@@ -296,11 +294,10 @@ class User:
 						driver=self.get_dedicated_driver(),
 						)
 						
-			row = self.db.add_row({'video':video, 'post_date': dt_now()})
+			row = self.db.add_row({'video':video, 'post_date': time.time()})
 
 			vid_row = self.active_videos.add_row({'video':video})
 
-			self.db.to_csv('../data/csv/'+self.email+'.csv')
 		except InsufficientAuth:
 			xprint('/rh/', f'[{self.email}] InsufficientAuth\n\tPlease login to TikTok and save the cookies as cookies/{self.email}.cookie', "/=/")
 
@@ -311,7 +308,6 @@ class User:
 		
 		tdr.update({'active_time':time.time() - upload_time_start})
 
-		self.tdb.to_csv('../data/csv/'+self.email+'_time.csv')
 
 		xprint('/y/', f'[{self.email}] Uploaded {video}', '/=/')
 
@@ -343,16 +339,11 @@ class User:
 		
 		
 		# check if 3 videos have been uploaded today
-		uploaded_today = 0
-		if self.db.height >= 3:
-			for i in range(1,4):
-				if self.db.row(i*-1)['post_date'].split(' ')[0] != dt_now().split(' ')[0]:
-					break
-				uploaded_today += 1
-			else:
-				xprint(f'>> /g/[{self.email}]/=/ Todays Upload limit reached (today {uploaded_today}) 	(total {self.db.height} done)', '/=/')
-				self.light_warm_up()
-				return None
+		uploaded_today = self.uploads.day()['count']
+		if uploaded_today >= 3:
+			xprint(f'>> /g/[{self.email}]/=/ Todays Upload limit reached (today {uploaded_today}) 	(total {self.db.height} done)', '/=/')
+			self.light_warm_up()
+			return None
 
 		# xprint(f'>> /y/[{self.email}]/=/ Uploading Random Video (today {uploaded_today}) (total {self.db.height} done)', '/=/')
 		
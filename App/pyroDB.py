@@ -38,12 +38,28 @@ import sys
 import os
 import signal
 import atexit
-import shutil
 from collections.abc import Iterable
+from collections import Counter
+import builtins
+from contextlib import contextmanager
 import time
+import datetime
 import random
+import bisect
+import operator
+import array
+import struct
+import zlib
+import lzma
+import mmap
+import ctypes
+import ctypes.util
+import weakref
+import types
+import functools
+import hashlib
 from tempfile import NamedTemporaryFile
-from threading import Thread
+from threading import Thread, Lock, RLock, Condition
 import csv
 import json
 
@@ -56,19 +72,931 @@ from typing import Union
 from tabulate import tabulate
 import msgpack
 
-def load(location, auto_dump, sig=True):
+try:
+	import fcntl  # optional, file_lock (not on windows)
+except ImportError:
+	fcntl = None
+
+try:
+	import zstandard  # optional, compression="zstd"
+except ImportError:
+	zstandard = None
+
+try:
+	import lz4.frame  # optional, compression="lz4"
+except ImportError:
+	lz4 = None
+
+try:
+	import pyarrow as pa  # optional, to_arrow/to_parquet
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = pq = None
+
+try:
+	import numpy as np  # optional, column_array and faster column statistics
+except ImportError:
+	np = None
+
+# numpy style dtype of typed columns -> array.array typecode
+DTYPES = {
+	"f8": "d", "f4": "f",
+	"i8": "q", "i4": "i", "i2": "h", "i1": "b",
+	"u8": "Q", "u4": "I", "u2": "H", "u1": "B",
+}
+
+_INT64 = (-1 << 63, (1 << 63) - 1)
+
+class _PickleTArray(array.array):
+	"""
+	array.array backing a typed table column (see `PickleTable.add_column(dtype=...)`)
+	None is stored as NaN (float) or 0 (int), everything else must be a number
+	"""
+	__slots__ = ("dtype",)
+
+	def __new__(cls, dtype, values=()):
+		if dtype not in DTYPES:
+			raise ValueError("dtype must be one of {}".format(tuple(DTYPES)))
+
+		self = super().__new__(cls, DTYPES[dtype])
+		self.dtype = dtype
+		self.extend(values)
+		return self
+
+	@property
+	def missing(self):
+		return float("nan") if self.typecode in "fd" else 0
+
+	def __setitem__(self, index, value):
+		if value is None:
+			value = self.missing
+		super().__setitem__(index, value)
+
+	def append(self, value):
+		super().append(self.missing if value is None else value)
+
+	def insert(self, index, value):
+		super().insert(index, self.missing if value is None else value)
+
+	def extend(self, values):
+		if isinstance(values, array.array) and values.typecode == self.typecode:
+			super().extend(values)
+			return
+
+		missing = self.missing
+		super().extend([missing if v is None else v for v in values])
+
+	def clear(self):
+		del self[:]
+
+	def stored(self, value):
+		'''value as the column would store it, TypeError/OverflowError if it can't (the column is not changed)'''
+		if type(value) is float and self.typecode == "d" or type(value) is int and self.typecode == "q" and _INT64[0] <= value <= _INT64[1]:
+			return value # stored as is, no need to try it
+		return array.array(self.typecode, (self.missing if value is None else value,))[0]
+
+	def copy(self):
+		return _PickleTArray(self.dtype, self)
+
+	def __reduce__(self):
+		return _PickleTArray, (self.dtype, self.tolist())
+
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S" # strings "ts" columns accept (local time) and csv exports write
+
+def _epoch(value):
+	'''int epoch seconds of a number, datetime, date or TIME_FORMAT / "YYYY-MM-DD" string (None stays None)'''
+	if value is None or isinstance(value, int):
+		return value
+	if isinstance(value, float):
+		return None if value != value else int(value)
+	if isinstance(value, str):
+		return int(time.mktime(time.strptime(value, TIME_FORMAT if len(value) > 10 else "%Y-%m-%d")))
+	if isinstance(value, datetime.datetime):
+		return int(value.timestamp())
+	if isinstance(value, datetime.date):
+		return int(time.mktime(value.timetuple()))
+	raise TypeError("Can not use {!r} as a timestamp".format(value))
+
+@functools.lru_cache(maxsize=1 << 16)
+def _quarter_day(quarter):
+	'''local date ordinal of the 15 minutes starting at quarter*900 (utc offsets are multiples of 15 minutes)'''
+	return datetime.date.fromtimestamp(quarter * 900).toordinal()
+
+def _day_ordinal(day=None):
+	'''local date ordinal of a date, datetime, "YYYY-MM-DD..." string or timestamp, None for today'''
+	if day is None:
+		return datetime.date.today().toordinal()
+	if isinstance(day, str):
+		return datetime.date.fromisoformat(day[:10]).toordinal()
+	if isinstance(day, datetime.datetime):
+		return day.date().toordinal()
+	if isinstance(day, datetime.date):
+		return day.toordinal()
+	return _quarter_day(int(day) // 900)
+
+class _PickleTTime(_PickleTArray):
+	"""
+	Timestamp table column (see `PickleTable.add_column(dtype="ts")`), int64 epoch seconds.
+	Cells are set from numbers, datetimes or TIME_FORMAT strings and read back as int (None is 0).
+	Keeps a local day -> row positions index, built on first use and kept up to date by appends
+	"""
+	__slots__ = ("_days",)
+
+	missing = 0
+
+	def __new__(cls, values=()):
+		self = array.array.__new__(cls, "q")
+		self.dtype = "ts"
+		self._days = None
+		self.extend(values)
+		return self
+
+	def __setitem__(self, index, value):
+		self._days = None
+		super().__setitem__(index, _epoch(value))
+
+	def __delitem__(self, index):
+		self._days = None
+		super().__delitem__(index)
+
+	def append(self, value):
+		super().append(_epoch(value))
+		if self._days is not None and self[-1]:
+			self._days.setdefault(_quarter_day(self[-1] // 900), []).append(len(self) - 1)
+
+	def insert(self, index, value):
+		self._days = None
+		super().insert(index, _epoch(value))
+
+	def extend(self, values):
+		self._days = None
+		if not (isinstance(values, array.array) and values.typecode == self.typecode):
+			values = list(map(_epoch, values))
+		super().extend(values)
+
+	def pop(self, index=-1):
+		self._days = None
+		return super().pop(index)
+
+	def remove(self, value):
+		self._days = None
+		super().remove(_epoch(value))
+
+	def stored(self, value):
+		value = _epoch(value)
+		if type(value) is int and _INT64[0] <= value <= _INT64[1]:
+			return value
+		return super().stored(value)
+
+	def copy(self):
+		return _PickleTTime(self)
+
+	def __reduce__(self):
+		return _PickleTTime, (self.tolist(),)
+
+	def days(self) -> dict:
+		'''{local date ordinal: [row positions]} of the cells that are set, in row order'''
+		if self._days is not None:
+			return self._days
+
+		days = {}
+		if np is not None and len(self) > 64:
+			arr = np.frombuffer(self[:], dtype=np.int64) # copy, a view would block appends (BufferError)
+			quarters, inverse = np.unique(arr // 900, return_inverse=True)
+			ordinals = np.array([_quarter_day(int(q)) for q in quarters], dtype=np.int64)[inverse.ravel()]
+			ordinals[arr == 0] = 0 # not set
+			order = np.argsort(ordinals, kind="stable")
+			ordinals = ordinals[order]
+			starts = np.flatnonzero(np.diff(ordinals)) + 1
+			for day, rows in zip(ordinals[np.r_[0, starts]].tolist(), np.split(order, starts)):
+				if day:
+					days[day] = rows.tolist()
+		else:
+			for r, ts in enumerate(self):
+				if ts:
+					days.setdefault(_quarter_day(ts // 900), []).append(r)
+
+		self._days = days
+		return days
+
+	def on_day(self, day=None) -> list:
+		'''Positions of the rows on local `day` (see `_day_ordinal`, None is today)'''
+		return self.days().get(_day_ordinal(day), [])
+
+	def format(self, value):
+		'''TIME_FORMAT string of a cell, "" if it is not set'''
+		return time.strftime(TIME_FORMAT, time.localtime(value)) if value else ""
+
+
+class _PickleTCategory:
+	"""
+	Categorical table column (see `PickleTable.add_column(dtype="category")`)
+	every distinct value is stored once, cells are uint32 codes into `values` (code 0 is None).
+	Behaves like the list it replaces, cells are only looked up when they are read
+	"""
+	__slots__ = ("codes", "values", "_lookup")
+
+	dtype = "category"
+
+	def __init__(self, values=()):
+		self.codes = array.array("I")
+		self.values = [None] # code -> value
+		self._lookup = {None: 0} # value -> code
+		self.extend(values)
+
+	@classmethod
+	def _from_codes(cls, values, codes):
+		self = cls.__new__(cls)
+		self.codes = codes
+		self.values = values
+		self._lookup = {v: c for c, v in enumerate(values)}
+		return self
+
+	def code(self, value):
+		'''Code of value, adding it to the categories if it is new'''
+		code = self._lookup.get(value)
+		if code is None:
+			code = self._lookup[value] = len(self.values)
+			self.values.append(value)
+		return code
+
+	def stored(self, value):
+		'''value itself, TypeError if it can't be a category (the column is not changed)'''
+		hash(value)
+		return value
+
+	def codes_where(self, test):
+		'''Set of the codes whose value passes test(value), each distinct value is tested once'''
+		return {c for c, v in enumerate(self.values) if test(v)}
+
+	def positions(self, codes):
+		'''Indexes of the cells holding one of `codes` (a set)'''
+		if np is not None and len(self.codes) > 64:
+			arr = np.frombuffer(self.codes[:], dtype=np.uint32) # copy, a view would block appends (BufferError)
+			return np.flatnonzero(np.isin(arr, list(codes))).tolist()
+		return [r for r, c in enumerate(self.codes) if c in codes]
+
+	def __len__(self):
+		return len(self.codes)
+
+	def __iter__(self):
+		return map(self.values.__getitem__, self.codes)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return list(map(self.values.__getitem__, self.codes[index]))
+		return self.values[self.codes[index]]
+
+	def __setitem__(self, index, value):
+		self.codes[index] = self.code(value)
+
+	def __delitem__(self, index):
+		del self.codes[index]
+
+	def __contains__(self, value):
+		code = self._lookup.get(value)
+		return code is not None and code in self.codes
+
+	def __eq__(self, other):
+		if isinstance(other, _PickleTCategory):
+			return list(self) == list(other)
+		if isinstance(other, list):
+			return list(self) == other
+		return NotImplemented
+
+	def __repr__(self):
+		return "{}({!r})".format(type(self).__name__, list(self))
+
+	def append(self, value):
+		self.codes.append(self.code(value))
+
+	def insert(self, index, value):
+		self.codes.insert(index, self.code(value))
+
+	def extend(self, values):
+		if isinstance(values, _PickleTCategory):
+			values = list(values)
+		self.codes.extend(map(self.code, values))
+
+	def pop(self, index=-1):
+		return self.values[self.codes.pop(index)]
+
+	def remove(self, value):
+		code = self._lookup.get(value)
+		if code is None:
+			raise ValueError("{!r} is not in the column".format(value))
+		self.codes.remove(code)
+
+	def index(self, value, *args):
+		code = self._lookup.get(value)
+		if code is None:
+			raise ValueError("{!r} is not in the column".format(value))
+		return self.codes.index(code, *args)
+
+	def count(self, value):
+		code = self._lookup.get(value)
+		return 0 if code is None else self.codes.count(code)
+
+	def clear(self):
+		del self.codes[:]
+
+	def copy(self):
+		return _PickleTCategory._from_codes(self.values.copy(), array.array("I", self.codes))
+
+	def __reduce__(self):
+		return _PickleTCategory, (list(self),)
+
+
+def _column(dtype, values=()):
+	'''New typed column ("category", "ts" or one of DTYPES)'''
+	if dtype == "category":
+		return _PickleTCategory(values)
+	if dtype == "ts":
+		return _PickleTTime(values)
+	return _PickleTArray(dtype, values)
+
+
+# msgpack extension types
+_EXT_ARRAY = 1 # _PickleTArray and _PickleTTime
+_EXT_DICT = 2 # dictionary encoded string list, only on disk (decodes to a plain list)
+_EXT_CATEGORY = 3 # _PickleTCategory
+
+def _dict_encode(values):
+	'''ExtType holding the distinct strings of a list once plus one small int code per cell,
+	None if the list is not worth it (short, not only strings or too many distinct ones)'''
+	if len(values) < 16:
+		return None
+
+	codes = {}
+	for value in values:
+		if value is not None and type(value) is not str:
+			return None
+		codes.setdefault(value, len(codes))
+	if len(codes) * 2 > len(values):
+		return None
+
+	typecode = "B" if len(codes) <= 0xff else "H" if len(codes) <= 0xffff else "I"
+	arr = array.array(typecode, map(codes.__getitem__, values))
+	if sys.byteorder == "big":
+		arr.byteswap()
+	return msgpack.ExtType(_EXT_DICT, msgpack.packb([typecode, list(codes), arr.tobytes()]))
+
+def _msgpack_default(obj):
+	'''Serialize the objects msgpack does not know'''
+	if isinstance(obj, _PickleTArray):
+		# one contiguous little endian blob instead of one msgpack number per cell
+		if sys.byteorder == "big":
+			obj = obj.copy()
+			obj.byteswap()
+		return msgpack.ExtType(_EXT_ARRAY, obj.dtype.encode() + b"\0" + obj.tobytes())
+
+	if isinstance(obj, _PickleTCategory):
+		codes = obj.codes
+		if sys.byteorder == "big":
+			codes = array.array("I", codes)
+			codes.byteswap()
+		return msgpack.ExtType(_EXT_CATEGORY, msgpack.packb([obj.values, codes.tobytes()]))
+
+	raise TypeError("Can not serialize {!r}".format(type(obj).__name__))
+
+def _msgpack_ext_hook(code, data):
+	if code == _EXT_ARRAY:
+		sep = data.index(b"\0")
+		arr = _column(bytes(data[:sep]).decode())
+		array.array.frombytes(arr, memoryview(data)[sep+1:])
+		if sys.byteorder == "big":
+			arr.byteswap()
+		return arr
+
+	if code == _EXT_DICT:
+		typecode, strings, raw = msgpack.unpackb(data)
+		codes = array.array(typecode, raw)
+		if sys.byteorder == "big":
+			codes.byteswap()
+		return list(map(strings.__getitem__, codes))
+
+	if code == _EXT_CATEGORY:
+		values, raw = msgpack.unpackb(data)
+		codes = array.array("I", raw)
+		if sys.byteorder == "big":
+			codes.byteswap()
+		return _PickleTCategory._from_codes(values, codes)
+
+	return msgpack.ExtType(code, data)
+
+def _packb(obj):
+	return msgpack.packb(obj, default=_msgpack_default)
+
+
+# ---------------- COLUMN DIRECTORY FILE LAYOUT ----------------
+# magic (4) | version (1) | flags (1) | header length (uint32 LE) | header | value blobs
+# header: msgpack [[key, offset, length, count], ...], offsets are relative to the first blob
+# flags: compression codec id of the blobs (the header is never compressed)
+# every top level value (table column) is its own msgpack blob, so it can be decoded alone
+# 0xc1 is never used by msgpack, plain msgpack files (old format) can't start with it
+_MAGIC = b"\xc1PDB"
+_FORMAT_VERSION = 1
+_PREFIX = struct.Struct("<BBI")
+_HEAD_START = len(_MAGIC) + _PREFIX.size
+
+# compression of the value blobs, the codec id (index) is stored in the flags byte of the prefix
+_CODECS = ("none", "zlib", "lzma", "zstd", "lz4")
+
+def _codec_id(compression):
+	'''Codec id of a `compression` name, raises if it is unknown or its package is not installed'''
+	if compression is None:
+		return 0
+	if compression not in _CODECS:
+		raise ValueError("compression must be one of {}".format(_CODECS))
+	if compression == "zstd" and zstandard is None:
+		raise ImportError("compression='zstd' needs the zstandard package")
+	if compression == "lz4" and lz4 is None:
+		raise ImportError("compression='lz4' needs the lz4 package")
+	return _CODECS.index(compression)
+
+def _compress(codec, data):
+	if codec == 1:
+		return zlib.compress(data)
+	if codec == 2:
+		return lzma.compress(data)
+	if codec == 3:
+		return zstandard.ZstdCompressor().compress(data)
+	if codec == 4:
+		return lz4.frame.compress(data)
+	return data
+
+def _decompress(codec, data):
+	if codec and codec < len(_CODECS):
+		_codec_id(_CODECS[codec]) # file written with a codec that is not installed here
+	if codec == 1:
+		return zlib.decompress(data)
+	if codec == 2:
+		return lzma.decompress(data)
+	if codec == 3:
+		return zstandard.ZstdDecompressor().decompress(data)
+	if codec == 4:
+		return lz4.frame.decompress(data)
+	if codec:
+		raise ValueError("Unknown compression codec {}".format(codec))
+	return data
+
+def _unpackb(buf):
+	return msgpack.unpackb(buf, ext_hook=_msgpack_ext_hook)
+
+def _count(value):
+	return len(value) if isinstance(value, (list, dict, array.array, _PickleTCategory)) else -1
+
+def _encode_db(db, compression=None, dict_encode=False):
+	'''Encode db in the column directory layout, returns the list of chunks to write
+	compression: blob codec (see _CODECS)
+	dict_encode: store string columns with many repeated values as distinct values + codes'''
+	codec = _codec_id(compression)
+	lazy = isinstance(db, _LazyDB)
+	header = []
+	blobs = []
+	offset = 0
+	for key in list(db.keys()):
+		blob = db.raw(key) if lazy else None
+		if blob is None:
+			value = db[key]
+			packed = _dict_encode(value) if dict_encode and isinstance(value, list) else None
+			blob = _compress(codec, _packb(value if packed is None else packed))
+			count = _count(value)
+		else: # never decoded, copy it as it is
+			if db.codec != codec:
+				blob = _compress(codec, _decompress(db.codec, blob))
+			count = db.length(key)
+
+		header.append([key, offset, len(blob), count])
+		blobs.append(blob)
+		offset += len(blob)
+
+	head = _packb(header)
+	return [_MAGIC, _PREFIX.pack(_FORMAT_VERSION, codec, len(head)), head, *blobs]
+
+def _decode_db(buf, lazy=True):
+	'''Decode a file content (column directory or plain msgpack)'''
+	if bytes(buf[:len(_MAGIC)]) != _MAGIC:
+		return _unpackb(buf) # old format, single msgpack map
+
+	version, flags, head_len = _PREFIX.unpack_from(buf, len(_MAGIC))
+	if version != _FORMAT_VERSION:
+		raise ValueError("Unsupported db file version {}".format(version))
+
+	view = memoryview(buf)
+	start = _HEAD_START + head_len
+	raw = {}
+	counts = {}
+	for key, offset, length, count in _unpackb(view[_HEAD_START:start]):
+		raw[key] = view[start + offset:start + offset + length]
+		counts[key] = count
+
+	db = _LazyDB(raw, counts, codec=flags)
+	if not lazy:
+		db = dict(db.items())
+	return db
+
+def _fsync_dir(directory):
+	'''Make a rename/create/delete in `directory` durable (no-op where directories can't be opened, ie: windows)'''
+	try:
+		fd = os.open(directory, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
+
+def _map_file(location):
+	'''Read only memory map of a file (None for empty files)'''
+	with open(location, 'rb') as f:
+		if not os.fstat(f.fileno()).st_size:
+			return None
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # stays valid after the file is closed
+
+def read_column(location, key):
+	'''
+	Read a single key (table column) of a db file without decoding the rest of it.
+	With the column directory layout only the header and that column are read from disk
+	'''
+	buf = _map_file(location)
+	if buf is None:
+		raise KeyError(key)
+
+	if buf[:len(_MAGIC)] != _MAGIC:
+		return _unpackb(buf)[key]
+
+	_, codec, head_len = _PREFIX.unpack_from(buf, len(_MAGIC))
+	view = memoryview(buf)
+	start = _HEAD_START + head_len
+	for name, offset, length, count in _unpackb(view[_HEAD_START:start]):
+		if name == key:
+			return _unpackb(_decompress(codec, view[start + offset:start + offset + length]))
+
+	raise KeyError(key)
+
+def _fork(db):
+	'''Copy of db with every top level container copied too (cells are shared)'''
+	if isinstance(db, _LazyDB):
+		return db.fork()
+	return {k: v.copy() if hasattr(v, "copy") else v for k, v in db.items()}
+
+
+class _LazyDB(dict):
+	"""
+	db read from a column directory file, every value stays encoded until it is first used.
+	Decoded values live in the dict itself so lookups run at dict speed, pending ones are
+	decoded by __missing__. Key order is the file order.
+	"""
+	def __init__(self, raw, counts=None, codec=0):
+		super().__init__()
+		self._raw = raw # key -> encoded value
+		self._counts = counts or {} # key -> length of the encoded value (-1 if not a container)
+		self.codec = codec # compression of the encoded values
+		self._order = list(raw) # every key in order
+
+	def __missing__(self, key):
+		blob = self._raw.pop(key) # KeyError if it is not there either
+		value = _unpackb(_decompress(self.codec, blob))
+		dict.__setitem__(self, key, value)
+		return value
+
+	def raw(self, key):
+		'''Encoded value of key, None if it has been decoded'''
+		return self._raw.get(key)
+
+	def length(self, key):
+		'''len() of a value without decoding it'''
+		if key in self._raw:
+			return self._counts[key]
+		return len(self[key])
+
+	def load_all(self):
+		for key in list(self._raw):
+			self[key]
+
+	def detach(self):
+		'''Copy the pending encoded values out of the source buffer (ie: before the mapped file is replaced)'''
+		for key, blob in self._raw.items():
+			self._raw[key] = bytes(blob)
+
+	def fork(self):
+		db = _LazyDB(dict(self._raw), self._counts, self.codec)
+		db._order = self._order.copy()
+		for key, value in dict.items(self):
+			dict.__setitem__(db, key, value.copy() if hasattr(value, "copy") else value)
+		return db
+
+	def __contains__(self, key):
+		return dict.__contains__(self, key) or key in self._raw
+
+	def __len__(self):
+		return len(self._order)
+
+	def __iter__(self):
+		return iter(self._order.copy())
+
+	def keys(self):
+		return self._order.copy()
+
+	def values(self):
+		return [self[k] for k in self._order]
+
+	def items(self):
+		return [(k, self[k]) for k in self._order]
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def __setitem__(self, key, value):
+		if key not in self:
+			self._order.append(key)
+		self._raw.pop(key, None)
+		dict.__setitem__(self, key, value)
+
+	def __delitem__(self, key):
+		if key not in self:
+			raise KeyError(key)
+		self._order.remove(key)
+		if self._raw.pop(key, None) is None:
+			dict.__delitem__(self, key)
+
+	_marker = object()
+	def pop(self, key, default=_marker):
+		if key not in self:
+			if default is self._marker:
+				raise KeyError(key)
+			return default
+		value = self[key]
+		del self[key]
+		return value
+
+	def popitem(self):
+		key = self._order[-1]
+		return key, self.pop(key)
+
+	def setdefault(self, key, default=None):
+		if key not in self:
+			self[key] = default
+		return self[key]
+
+	def update(self, *args, **kwargs):
+		for key, value in dict(*args, **kwargs).items():
+			self[key] = value
+
+	def clear(self):
+		self._raw.clear()
+		self._order.clear()
+		dict.clear(self)
+
+	def copy(self):
+		return dict(self.items())
+
+	def __eq__(self, other):
+		return dict(self.items()) == other
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return repr(dict(self.items()))
+
+
+class _InotifyWatcher:
+	"""
+	One inotify instance and thread shared by every db opened with rescan_policy="inotify" (Linux only).
+	Watches the directories of the db files and flags a db as changed when its file (or wal) is written or replaced
+	"""
+	IN_MODIFY = 0x2
+	IN_CLOSE_WRITE = 0x8
+	IN_MOVED_TO = 0x80
+	IN_CREATE = 0x100
+	IN_DELETE = 0x200
+	MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+	_event = struct.Struct("iIII") # wd, mask, cookie, len (+ name)
+
+	_instance = None
+	_instance_lock = Lock()
+
+	@classmethod
+	def get(cls):
+		'''Return the shared watcher, None if inotify is not available'''
+		with cls._instance_lock:
+			if cls._instance is None:
+				try:
+					cls._instance = cls()
+				except (OSError, AttributeError) as e:
+					logger.info("inotify not available: %s", e)
+					cls._instance = False
+			return cls._instance or None
+
+	def __init__(self):
+		if not sys.platform.startswith("linux"):
+			raise OSError("inotify is only available on Linux")
+
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+		self.lock = Lock()
+		self.dirs = {} # directory -> watch descriptor
+		self.watched = {} # watch descriptor -> {file name: WeakSet of dbs}
+
+		Thread(target=self._run, name="pyroDB-inotify", daemon=True).start()
+
+	def watch(self, db):
+		directory, name = os.path.split(os.path.abspath(db.location))
+		with self.lock:
+			wd = self.dirs.get(directory)
+			if wd is None:
+				wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+				if wd < 0:
+					raise OSError(ctypes.get_errno(), "inotify_add_watch failed on " + directory)
+				self.dirs[directory] = wd
+
+			self.watched.setdefault(wd, {}).setdefault(name, weakref.WeakSet()).add(db)
+
+	def _run(self):
+		while True:
+			try:
+				data = os.read(self.fd, 64 * 1024)
+			except InterruptedError:
+				continue
+
+			pos = 0
+			while pos < len(data):
+				wd, mask, cookie, length = self._event.unpack_from(data, pos)
+				pos += self._event.size
+				name = os.fsdecode(data[pos:pos + length].rstrip(b"\0"))
+				pos += length
+
+				if name.endswith(".wal"):
+					name = name[:-4]
+
+				with self.lock:
+					dbs = list(self.watched.get(wd, {}).get(name, ()))
+				for db in dbs:
+					db._changed = True
+
+
+class _Flusher:
+	"""
+	One daemon thread writing the dirty `async_dump` dbs (and `export_csv` files) in the background.
+	A db is written `flush_interval` seconds after its first unsaved change,
+	everything changed in the meantime goes out with that one write.
+	"""
+	_instance = None
+	_instance_lock = Lock()
+
+	@classmethod
+	def get(cls):
+		with cls._instance_lock:
+			if cls._instance is None:
+				cls._instance = cls()
+			return cls._instance
+
+	def __init__(self):
+		self.cond = Condition()
+		self.due = {} # db -> time.monotonic() deadline
+
+		Thread(target=self._run, name="pyroDB-flusher", daemon=True).start()
+		atexit.register(self.drain)
+
+	def schedule(self, db):
+		with self.cond:
+			if db not in self.due:
+				self.due[db] = time.monotonic() + db.flush_interval
+				self.cond.notify()
+
+	def cancel(self, db):
+		with self.cond:
+			self.due.pop(db, None)
+
+	def _run(self):
+		while True:
+			with self.cond:
+				if not self.due:
+					self.cond.wait()
+					continue
+				db, deadline = min(self.due.items(), key=lambda item: item[1])
+				delay = deadline - time.monotonic()
+				if delay > 0:
+					self.cond.wait(delay)
+					continue
+				del self.due[db]
+
+			try:
+				db._flush_pending()
+			except Exception:
+				logger.exception("--async dump of %s failed--", db.location)
+
+	def drain(self):
+		'''Write everything that is still pending (atexit, SIGTERM)'''
+		with self.cond:
+			dbs = list(self.due)
+			self.due.clear()
+		for db in dbs:
+			db.flush()
+
+
+def _locked(func):
+	'''Run the method while holding the (reentrant) lock of the db/table'''
+	@functools.wraps(func)
+	def inner(self, *args, **kwargs):
+		with self._lock:
+			return func(self, *args, **kwargs)
+	return inner
+
+
+def load(location, auto_dump, sig=True, **kwargs):
 	'''Return a pickledb object. location is the path to the json file.'''
-	return PickleDB(location, auto_dump, sig)
+	return PickleDB(location, auto_dump, sig, **kwargs)
 
 class PickleDB(object):
 
 	key_string_error = TypeError('Key/name must be a string!')
 
-	def __init__(self, location="", auto_dump=True, sig=True):
+	rescan_policies = ("always", "interval", "inotify", "never")
+
+	durabilities = ("none", "file", "full")
+
+	def __init__(self, location="", auto_dump=True, sig=True, wal=False, wal_limit=4*1024*1024, lazy=True, use_mmap=False,
+			rescan_policy="always", rescan_interval=1.0, file_lock=False, async_dump=False, flush_interval=0.05,
+			durability="none", compression=None, dict_encode=False):
 		'''Creates a database object and loads the data from the location path.
 		If the file does not exist it will be created on the first update.
+
+		wal: append mutations to a `<location>.wal` sidecar instead of rewriting the whole file on every auto dump
+		wal_limit: size (bytes) of the wal file after which it is folded back into the main file
+		lazy: decode each key (table column) on first access instead of all of them on load
+		use_mmap: decode straight from a memory map of the file instead of reading it into memory first
+			(with `lazy`, columns that are never used are never read from disk)
+		rescan_policy: how often rescan() checks the file for outside changes
+			"always" stat on every call, "interval" stat at most every `rescan_interval` seconds,
+			"inotify" only after the file was changed (Linux, otherwise same as "interval"), "never" don't check
+		file_lock: take an advisory lock on `<location>.lock` while loading (shared) and writing (exclusive)
+			so other processes never see a half written file/wal (needs fcntl, ignored elsewhere)
+		async_dump: auto dump marks the db dirty and returns, a background thread writes it
+			at most every `flush_interval` seconds (call flush() or close() to wait for it)
+		durability: what a dump/wal commit waits for before it returns
+			"none" the OS has the data, "file" the data is fsynced, "full" the directory entry is fsynced too
+		compression: compress every column of the file with "zlib", "lzma", "zstd" or "lz4" (the last two if installed)
+			files are read with whatever codec they were written with
+		dict_encode: store string columns with many repeated values (paths, dates) as distinct values + codes
 		'''
+		self._lock = RLock() # guards self.db and the wal buffers against other threads
+
+		self.file_lock = file_lock
+		self._flock_fd = None
+		self._flock_depth = 0
+		self._flock_mode = None
+
 		self.db = {}
+		self.lazy = lazy
+		self.use_mmap = use_mmap
+
+		if rescan_policy not in self.rescan_policies:
+			raise ValueError("rescan_policy must be one of {}".format(self.rescan_policies))
+		self.rescan_policy = rescan_policy
+
+		if durability not in self.durabilities:
+			raise ValueError("durability must be one of {}".format(self.durabilities))
+		self.durability = durability
+
+		_codec_id(compression) # fail early on unknown/missing codecs
+		self.compression = compression
+		self.dict_encode = dict_encode
+		self.dump_stats = {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0} # dump latency (seconds)
+		self.rescan_interval = rescan_interval
+		self._last_scan = 0 # time.monotonic() of the last stat ("interval")
+		self._changed = False # set by the inotify watcher
+
+		self.wal = wal
+		self.wal_limit = wal_limit
+		self._wal_records = [] # packed records waiting for the next commit
+		self._wal_pending = 0 # size of the waiting records
+		self._wal_sig = None # signature of the main file the wal belongs to
+		self._wal_dropped = False # records were left out of the queue (over wal_limit)
+		self._synced = None # _disk_state() when the file was last read or written by us
+
+		self._tx_depth = 0 # nesting level of transaction()
+
+		self.async_dump = async_dump
+		self.flush_interval = flush_interval
+		self._dirty = False # changed since the last dump (async_dump)
+		self._dump_gen = 0 # bumped for every snapshot taken for a dump
+		self._written_gen = 0 # snapshot the file currently holds
+
+		self.dump_hooks = [] # called after every full dump (ie: to save table indexes)
+
+		self.m_time = 0
+		self._loads = 0 # times the file was (re)loaded
+		self._seen_loads = 0 # _loads at the last rescan() call
 
 		self.in_memory = False
 		self.location = ""
@@ -78,13 +1006,29 @@ class PickleDB(object):
 			self.in_memory = True
 
 		self.dthread = None
-
-		self.m_time = 0
+		self._seen_loads = self._loads
 
 		self.auto_dump = auto_dump
 		if sig:
 			self.set_sigterm_handler()
 
+		if self.rescan_policy == "inotify":
+			self._watch()
+
+	def _watch(self):
+		'''Subscribe to the inotify watcher, fall back to "interval" if it is not available'''
+		if self.in_memory:
+			return
+
+		watcher = _InotifyWatcher.get()
+		try:
+			if watcher is None:
+				raise OSError("inotify is not available")
+			watcher.watch(self)
+		except OSError as e:
+			logger.info("rescan_policy 'inotify' falls back to 'interval' (%s)", e)
+			self.rescan_policy = "interval"
+
 	def __getitem__(self, item):
 		'''Syntax sugar for get()'''
 		return self.get(item, raiseErr=True)
@@ -114,6 +1058,8 @@ class PickleDB(object):
 		def sigterm_handler(*args, **kwargs):
 			if self.dthread is not None:
 				self.dthread.join()
+			if _Flusher._instance is not None:
+				_Flusher._instance.drain()
 		try:
 			signal.signal(signal.SIGTERM, sigterm_handler)
 			# ValueError: signal only works in main thread of the main interpreter
@@ -133,19 +1079,57 @@ class PickleDB(object):
 		if self.in_memory:
 			return
 		os.remove(self.location)
+		if os.path.exists(self.wal_location):
+			os.remove(self.wal_location)
 		self.location = ""
 		self.in_memory = True
 		return
 
+	@_locked
 	def rescan(self):
-		'''Rescan the file for changes'''
+		'''Rescan the file for changes (see `rescan_policy`), returns True if the db was reloaded
+		since the last call (here, or when a commit merged the writes of another process)'''
+		self._rescan_file()
+		reloaded = self._loads != self._seen_loads
+		self._seen_loads = self._loads
+		return reloaded
+
+	def _rescan_file(self):
 		if self.in_memory:
-			return
-		if os.path.exists(self.location):
-			m_time = os.stat(self.location).st_mtime
-			if m_time > self.m_time:
-				self._loaddb()
-				self.m_time = m_time
+			return False
+
+		policy = self.rescan_policy
+		if policy == "never":
+			return False
+		if policy == "interval":
+			now = time.monotonic()
+			if now - self._last_scan < self.rescan_interval:
+				return False
+			self._last_scan = now
+		elif policy == "inotify":
+			if not self._changed:
+				return False
+			self._changed = False
+
+		try:
+			m_time = self._stat_mtime()
+		except FileNotFoundError:
+			return False
+
+		if self._dirty:
+			# unsaved async changes, they'll overwrite the file anyway
+			return False
+
+		if m_time != self.m_time:
+			self._loaddb()
+			self.m_time = m_time
+
+	def _stat_mtime(self):
+		'''Change signature of the db file and its wal, even without `wal` (a writer may log to it)'''
+		state = self._disk_state()
+		if state[:3] == (0, 0, 0):
+			raise FileNotFoundError(self.location)
+		return state
 
 	def new(self):
 		self.db = {}
@@ -163,57 +1147,467 @@ class PickleDB(object):
 		self.auto_dump = auto_dump
 		if os.path.exists(location):
 			self._loaddb()
+			self.m_time = self._stat_mtime()
 		else:
 			self.new()
+			self._synced = self._disk_state()
 		return True
 
 	def set_location(self, location):
 		self.location = location
 		self.in_memory = False
 
+	@property
+	def lock_location(self):
+		return self.location + ".lock"
+
+	@property
+	def meta_location(self):
+		return self.location + ".meta"
+
+	@contextmanager
+	def _flock(self, exclusive=True):
+		'''Hold the file lock (if file_lock is enabled), nested calls reuse the outer lock.
+		A shared lock is upgraded in place if an exclusive one is requested inside it'''
+		if not self.file_lock or fcntl is None or self.in_memory:
+			yield
+			return
+
+		mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+		if self._flock_depth:
+			if exclusive and self._flock_mode != fcntl.LOCK_EX:
+				fcntl.flock(self._flock_fd, fcntl.LOCK_EX)
+				self._flock_mode = fcntl.LOCK_EX
+			self._flock_depth += 1
+			try:
+				yield
+			finally:
+				self._flock_depth -= 1
+			return
+
+		fd = os.open(self.lock_location, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			fcntl.flock(fd, mode)
+			self._flock_fd = fd
+			self._flock_mode = mode
+			self._flock_depth = 1
+			try:
+				yield
+			finally:
+				self._flock_depth = 0
+				self._flock_fd = None
+				self._flock_mode = None
+				fcntl.flock(fd, fcntl.LOCK_UN)
+		finally:
+			os.close(fd)
+
 	def _dump(self):
 		'''Dump to a temporary file, and then move to the actual location'''
 		if self.in_memory:
 			return
 
-		logger.info("--dumping--")
-		with NamedTemporaryFile(mode='wb', delete=False) as f:
-			msgpack.dump(self.db, f)
-		if os.stat(f.name).st_size != 0:
-			shutil.move(f.name, self.location)
+		with self._flock():
+			logger.info("--dumping--")
+			st = time.perf_counter()
+			self._dump_gen += 1
+			self._dirty = False
+			temp = self._write_temp(_encode_db(self.db, self.compression, self.dict_encode))
+			self._install(self._dump_gen, temp)
+			self._dump_took(time.perf_counter() - st)
+
+	def _write_temp(self, chunks, location=None):
+		'''Write the encoded db to a temporary file next to the db file, or `location`
+		(same filesystem, so the replace is atomic)'''
+		directory, name = os.path.split(os.path.abspath(location or self.location))
+		with NamedTemporaryFile(mode='wb', delete=False, dir=directory, prefix=name + ".", suffix=".tmp") as f:
+			try:
+				f.writelines(chunks)
+				if self.durability != "none":
+					f.flush()
+					os.fsync(f.fileno())
+			except BaseException:
+				f.close()
+				os.remove(f.name)
+				raise
+		return f.name
+
+	def _dump_took(self, seconds):
+		stats = self.dump_stats
+		stats["count"] += 1
+		stats["total"] += seconds
+		stats["last"] = seconds
+		stats["max"] = max(stats["max"], seconds)
+
+	def _install(self, gen, temp):
+		'''Move a written dump over the db file (unless a newer dump got there first) and clean up after it'''
+		if gen <= self._written_gen:
+			os.remove(temp)
+			return
+
+		with self._flock():
+			if os.stat(temp).st_size != 0:
+				if self.use_mmap and os.name == 'nt' and isinstance(self.db, _LazyDB):
+					self.db.detach() # windows can't replace a mapped file
+				os.replace(temp, self.location)
+			else:
+				os.remove(temp)
+			self._written_gen = gen
+
+			# the main file now holds everything, old wal (if any) is obsolete
+			self._wal_records.clear()
+			self._wal_pending = 0
+			self._wal_dropped = False
+			if os.path.exists(self.wal_location):
+				os.remove(self.wal_location)
+			self._wal_sig = None
+			self._synced = self._disk_state()
+
+			if self.durability == "full":
+				_fsync_dir(os.path.dirname(os.path.abspath(self.location)))
+
+		self.m_time = self._stat_mtime()
+
+		if not self._dirty: # otherwise the hooks run after the next dump
+			for hook in self.dump_hooks:
+				hook()
+
+	def _flush_pending(self):
+		'''Write the pending async changes, the snapshot is taken under the lock, the file is written outside it'''
+		with self._lock:
+			if not self._dirty or self.in_memory:
+				return
+			if self.wal:
+				# appends are small, keep them in order with the writers
+				self._dirty = False
+				self._commit_wal()
+				return
+			if self.file_lock:
+				# other processes may write between the snapshot and the replace, merge and write under the file lock
+				self._dirty = False
+				self.dump()
+				return
+
+			st = time.perf_counter()
+			self._dump_gen += 1
+			gen = self._dump_gen
+			self._dirty = False
+			chunks = list(_encode_db(self.db, self.compression, self.dict_encode))
+
+		temp = self._write_temp(chunks)
+		del chunks
+
+		with self._lock:
+			self._install(gen, temp)
+			self._dump_took(time.perf_counter() - st)
+
+	@_locked
+	def flush(self):
+		'''Write the pending async changes now, returns once they are in the file'''
+		if self.in_memory:
+			return
+		if self._dirty or self._written_gen < self._dump_gen:
+			self._dirty = False
+			if self.wal:
+				self._commit_wal()
+			else:
+				self.dump()
 
-		self.m_time = os.stat(self.location).st_mtime
+	def close(self):
+		'''Flush the pending changes and stop the background writes for this db'''
+		if _Flusher._instance is not None:
+			_Flusher._instance.cancel(self)
+		self.flush()
 
+	@_locked
 	def dump(self):
 		'''Force dump memory db to file'''
 
 		if self.in_memory:
 			return
 
-		self.dthread = Thread(target=self._dump)
-		self.dthread.start()
-		self.dthread.join()
+		with self._flock():
+			if self.wal or self.file_lock:
+				with self._lock:
+					self._merge_disk() # here, an error in the dump thread would go unnoticed
+			self.dthread = Thread(target=self._dump)
+			self.dthread.start()
+			self.dthread.join()
 		return True
 
 	# save = PROXY OF SELF.DUMP()
 	save = dump
 
+	def snapshot(self, path, background=True):
+		'''
+		Write a point in time copy of the db (as it is in memory, changes not dumped yet included) to `path`,
+		in the same format as the db file. Only the top level containers are copied under the lock,
+		encoding and writing happen outside of it so writers are not blocked.
+		`path` is replaced atomically, it never holds a half written snapshot
+		# background: write from a new thread and return it (join() to wait), else write before returning
+
+		ie: db.snapshot("../backup/accounts-{}.pdb".format(time.strftime("%Y%m%d")))
+		'''
+		with self._lock:
+			db = _fork(self.db) # lazy values that were never decoded are shared, not copied
+
+		return self._snapshot(db, path, background)
+
+	def _snapshot(self, db, path, background=True):
+		'''Write a forked db to path (see `snapshot`)'''
+		if not background:
+			self._write_snapshot(db, path)
+			return None
+
+		thread = Thread(target=self._write_snapshot, args=(db, path, True), name="pyroDB snapshot")
+		thread.start() # not a daemon, exit waits for it
+		return thread
+
+	def _write_snapshot(self, db, path, log_errors=False):
+		try:
+			temp = self._write_temp(_encode_db(db, self.compression, self.dict_encode), path)
+			os.replace(temp, path)
+			if self.durability == "full":
+				_fsync_dir(os.path.dirname(os.path.abspath(path)))
+		except Exception:
+			if not log_errors:
+				raise
+			logger.exception("Snapshot to %s failed", path)
+
 	def _loaddb(self):
 		'''Load or reload the json info from the file'''
-		try:
+		with self._flock(exclusive=False):
+			self._loaddb_locked()
+
+	def _loaddb_locked(self):
+		if self.use_mmap:
+			data = _map_file(self.location)
+		else:
 			with open(self.location, 'rb') as f:
-				db = msgpack.load(f)
-				self.db:dict = db
-		except ValueError:
-			if os.stat(self.location).st_size == 0:  # Error raised because file is empty
-				self.new()
-			else:
-				raise  # File is not empty, avoid overwriting it
+				data = f.read()
+
+		if data:
+			self.db:dict = _decode_db(data, lazy=self.lazy)
+		else: # empty file
+			self.new()
+
+		self._wal_records.clear()
+		self._wal_pending = 0
+		self._wal_dropped = False
+		self._replay_wal()
+		self._loads += 1
+		self._synced = self._disk_state()
 
 	def _autodumpdb(self):
 		'''Write/save the json dump into the file if auto_dump is enabled'''
 		if self.auto_dump:
+			if self.async_dump and not self.in_memory:
+				self._dirty = True
+				_Flusher.get().schedule(self)
+			elif self.wal:
+				self._commit_wal()
+			else:
+				self.dump()
+
+
+	# ---------------- WRITE-AHEAD LOG ----------------
+	# wal file layout: ["wal", <main file signature>, "batches"] followed by one msgpack bin per commit,
+	# holding that commit's mutation records [op, key, *args]. A commit cut short by a crash is a
+	# truncated bin and is skipped whole (files without "batches" hold the records themselves).
+	# records are only valid for the main file they were written against,
+	# so a wal left behind by a crash during compaction is ignored instead of being applied twice
+
+	@property
+	def wal_location(self):
+		return self.location + ".wal"
+
+	def _base_sig(self):
+		'''Signature of the main db file, (0, 0, 0) if it does not exist'''
+		try:
+			st = os.stat(self.location)
+		except FileNotFoundError:
+			return (0, 0, 0)
+		return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+	def _disk_state(self):
+		'''Signature of the main file and its wal, changes whenever any process writes either'''
+		try:
+			st = os.stat(self.wal_location)
+			wal = (st.st_size, st.st_mtime_ns)
+		except FileNotFoundError:
+			wal = (0, 0)
+		return self._base_sig() + wal
+
+	def _merge_disk(self):
+		'''
+		If another process wrote the file (or its wal) since we last read or wrote it, reload it and
+		apply our queued records on top, so writing our copy does not drop theirs (file lock held)
+		'''
+		if self._disk_state() == self._synced:
+			return
+		if self._wal_dropped:
+			raise RuntimeError("{} was changed by another process and the pending changes are too large to merge "
+				"(raise wal_limit or commit more often)".format(self.location))
+
+		logger.info("--merging changes from another process--")
+		records, pending = self._wal_records.copy(), self._wal_pending
+		self._loaddb_locked()
+		for record in records:
+			self._apply(_unpackb(record))
+		self._wal_records[:] = records
+		self._wal_pending = pending
+
+	def _record(self, op, key=None, *args):
+		'''Queue a mutation record for the next wal commit (no-op unless wal or file_lock is enabled,
+		with file_lock they are also what `_merge_disk` replays over the writes of other processes)'''
+		if not (self.wal or self.file_lock) or self.in_memory:
+			return
+
+		if self._wal_pending > self.wal_limit and not self.file_lock:
+			# too much un-committed work, the next commit will be a full dump anyway
+			self._wal_dropped = True
+			return
+
+		record = _packb([op, key, *args])
+		self._wal_records.append(record)
+		self._wal_pending += len(record)
+
+	@_locked
+	def _commit_wal(self):
+		'''Append the queued records to the wal in one write, compact the wal if it got too large'''
+		if self.in_memory:
+			return
+		if not self._wal_records:
+			return
+
+		with self._flock():
+			self._commit_wal_locked()
+
+	def _commit_wal_locked(self):
+		self._merge_disk()
+		size = os.path.getsize(self.wal_location) if os.path.exists(self.wal_location) else 0
+		if (size + self._wal_pending > self.wal_limit # time to compact
+			or not os.path.exists(self.location) # nothing to log against
+			or (size and self._wal_sig != self._base_sig())): # someone else rewrote the main file
 			self.dump()
+			return
+
+		with open(self.wal_location, 'ab') as f:
+			if not size:
+				self._wal_sig = self._base_sig()
+				f.write(msgpack.packb(["wal", self._wal_sig, "batches"]))
+			f.write(msgpack.packb(b"".join(self._wal_records))) # one bin: the commit applies whole or not at all
+			if self.durability != "none":
+				f.flush()
+				os.fsync(f.fileno())
+		if not size and self.durability == "full":
+			_fsync_dir(os.path.dirname(os.path.abspath(self.wal_location)))
+
+		self._wal_records.clear()
+		self._wal_pending = 0
+		self._synced = self._disk_state()
+
+		self.m_time = self._stat_mtime()
+
+	@contextmanager
+	def transaction(self):
+		'''Suspend auto dump inside the block and dump once (or commit the wal once) on exit.
+		If the block raises, the in-memory db is rolled back and nothing is written.
+		Nested blocks join the outermost one.
+
+		ie: with db.transaction():
+			db.set("a", 1)
+			db.ladd("b", 2)
+		'''
+		with self._lock, self._flock():
+			if self._tx_depth:
+				self._tx_depth += 1
+				try:
+					yield self
+				finally:
+					self._tx_depth -= 1
+				return
+
+			# top level containers are copied, cells themselves are not touched by the db methods
+			snapshot = _fork(self.db)
+			records = len(self._wal_records)
+			auto_dump = self.auto_dump
+
+			self._tx_depth = 1
+			self.auto_dump = False
+			try:
+				yield self
+			except BaseException:
+				self.db = snapshot
+				del self._wal_records[records:]
+				self._wal_pending = sum(map(len, self._wal_records))
+				raise
+			finally:
+				self._tx_depth = 0
+				self.auto_dump = auto_dump
+
+			self._autodumpdb()
+
+	def compact(self):
+		'''Fold the wal back into the main db file'''
+		return self.dump()
+
+	def _replay_wal(self):
+		'''Apply the records of a valid wal file on top of the loaded db'''
+		if not os.path.exists(self.wal_location):
+			return
+
+		with open(self.wal_location, 'rb') as f:
+			unpacker = msgpack.Unpacker(f, ext_hook=_msgpack_ext_hook)
+			try:
+				header = next(unpacker, None)
+				if not header or header[0] != "wal" or tuple(header[1]) != self._base_sig():
+					logger.info("--ignoring stale wal--")
+					return
+
+				self._wal_sig = tuple(header[1])
+				if len(header) < 3: # records written one by one
+					for record in unpacker:
+						self._apply(record)
+					return
+
+				for batch in unpacker:
+					records = msgpack.Unpacker(ext_hook=_msgpack_ext_hook)
+					records.feed(batch)
+					for record in list(records): # decoded before any is applied
+						self._apply(record)
+			except ValueError:
+				# half written commit at the end (crash during commit), everything before it is applied
+				logger.warning("wal of %s is truncated", self.location)
+
+	def _apply(self, record):
+		'''Apply a single wal record on self.db'''
+		op, key, *args = record
+		db = self.db
+
+		if op == "set":
+			db[key] = args[0]
+		elif op == "rem":
+			db.pop(key, None)
+		elif op == "clear":
+			db.clear()
+		elif op == "append":
+			db[key].append(args[0])
+		elif op == "extend":
+			db[key].extend(args[0])
+		elif op == "insert":
+			db[key].insert(args[0], args[1])
+		elif op == "iset":
+			db[key][args[0]] = args[1]
+		elif op == "ipop":
+			db[key].pop(args[0])
+		elif op == "remove":
+			db[key].remove(args[0])
+		elif op == "iclear":
+			db[key].clear()
+		elif op == "merge":
+			db[key].update(db[args[0]])
+		else:
+			raise ValueError("Unknown wal record: {}".format(op))
 
 
 	def validate_key(self, key):
@@ -223,12 +1617,14 @@ class PickleDB(object):
 		if not isinstance(key, (str, bytes)):
 			raise self.key_string_error
 
+	@_locked
 	def set(self, key, value):
 		'''Set the str value of a key'''
 		self.rescan()
 		self.validate_key(key)
 
 		self.db[key] = value
+		self._record("set", key, value)
 		self._autodumpdb()
 		return True
 
@@ -279,41 +1675,51 @@ class PickleDB(object):
 		self.rescan()
 		return key in self.db
 
+	@_locked
 	def rem(self, key):
 		'''Delete a key'''
 		self.rescan()
 		if not key in self.db: # return False instead of an exception
 			return False
 		del self.db[key]
+		self._record("rem", key)
 		self._autodumpdb()
 		return True
 
+	@_locked
 	def append(self, key, more):
 		'''Add more to a key's value'''
 		self.rescan()
 		tmp = self.db[key]
 		self.db[key] = tmp + more
+		self._record("set", key, self.db[key])
 		self._autodumpdb()
 		return True
 
+	@_locked
 	def lcreate(self, name):
 		'''Create a list, name must be str'''
 		if isinstance(name, str):
 			self.db[name] = []
+			self._record("set", name, [])
 			self._autodumpdb()
 			return True
 		else:
 			raise self.key_string_error
 
+	@_locked
 	def ladd(self, name, value):
 		'''Add a value to a list'''
 		self.db[name].append(value)
+		self._record("append", name, value)
 		self._autodumpdb()
 		return True
 
+	@_locked
 	def lextend(self, name, seq):
 		'''Extend a list with a sequence'''
 		self.db[name].extend(seq)
+		self._record("extend", name, seq)
 		self._autodumpdb()
 		return True
 
@@ -329,23 +1735,29 @@ class PickleDB(object):
 		'''Return range of values in a list '''
 		return self.db[name][start:end]
 
+	@_locked
 	def lremlist(self, name):
 		'''Remove a list and all of its values'''
 		number = len(self.db[name])
 		del self.db[name]
+		self._record("rem", name)
 		self._autodumpdb()
 		return number
 
+	@_locked
 	def lremvalue(self, name, value):
 		'''Remove a value from a certain list'''
 		self.db[name].remove(value)
+		self._record("remove", name, value)
 		self._autodumpdb()
 		return True
 
+	@_locked
 	def lpop(self, name, pos):
 		'''Remove one value in a list'''
 		value = self.db[name][pos]
 		del self.db[name][pos]
+		self._record("ipop", name, pos)
 		self._autodumpdb()
 		return value
 
@@ -353,10 +1765,12 @@ class PickleDB(object):
 		'''Returns the length of the list'''
 		return len(self.db[name])
 
+	@_locked
 	def lappend(self, name, pos, more):
 		'''Add more to a value in a list'''
 		tmp = self.db[name][pos]
 		self.db[name][pos] = tmp + more
+		self._record("iset", name, pos, self.db[name][pos])
 		self._autodumpdb()
 		return True
 
@@ -364,18 +1778,22 @@ class PickleDB(object):
 		'''Determine if a value  exists in a list'''
 		return value in self.db[name]
 
+	@_locked
 	def dcreate(self, name):
 		'''Create a dict, name must be str'''
 		if isinstance(name, str):
 			self.db[name] = {}
+			self._record("set", name, {})
 			self._autodumpdb()
 			return True
 		else:
 			raise self.key_string_error
 
+	@_locked
 	def dadd(self, name, pair):
 		'''Add a key-value pair to a dict, "pair" is a tuple'''
 		self.db[name][pair[0]] = pair[1]
+		self._record("iset", name, pair[0], pair[1])
 		self._autodumpdb()
 		return True
 
@@ -387,16 +1805,20 @@ class PickleDB(object):
 		'''Return all key-value pairs from a dict'''
 		return self.db[name]
 
+	@_locked
 	def drem(self, name):
 		'''Remove a dict and all of its pairs'''
 		del self.db[name]
+		self._record("rem", name)
 		self._autodumpdb()
 		return True
 
+	@_locked
 	def dpop(self, name, key):
 		'''Remove one key-value pair in a dict'''
 		value = self.db[name][key]
 		del self.db[name][key]
+		self._record("ipop", name, key)
 		self._autodumpdb()
 		return value
 
@@ -412,17 +1834,21 @@ class PickleDB(object):
 		'''Determine if a key exists or not in a dict'''
 		return key in self.db[name]
 
+	@_locked
 	def dmerge(self, name1, name2):
 		'''Merge two dicts together into name1'''
 		first = self.db[name1]
 		second = self.db[name2]
 		first.update(second)
+		self._record("merge", name1, name2)
 		self._autodumpdb()
 		return True
 
+	@_locked
 	def deldb(self):
 		'''Delete everything from the database'''
 		self.db = {}
+		self._record("clear")
 		self._autodumpdb()
 		return True
 
@@ -434,7 +1860,7 @@ class PickleTable(dict):
 class _PickleTCell:
 	pass
 
-class _PickleTRow(dict):
+class _PickleTRow:
 	pass
 
 class _PickleTColumn(list):
@@ -445,19 +1871,38 @@ class _PickleTColumn(list):
 
 class PickleTable:
 	def __init__(self, filename="", *args, **kwargs):
+		'''filename and the other arguments are the ones of `PickleDB` (see `PickleCatalog.table` for tables sharing a file)'''
 		self.CC = 0 # consider it as country code and every items are its people. they gets NID
+		# bumped on every structural change (columns added/removed, reload), row/cell/column objects
+		# made before it are invalid
 
 		self.gen_CC()
 
+		self._layout = 0 # bumped whenever rows move or disappear, row/cell objects cache their index until then
 
-		self.busy = False
-		self._pk = PickleDB(filename, *args, **kwargs)
+
+		self._indexes = {} # column name -> _PickleTIndex
+		self._rollups = {} # date column name -> _PickleTRollup
+		self._csv_exports = {} # csv path -> _PickleTCSV (incremental exports)
+		self._feeds = [] # _PickleTFeed observers (see `on_change`)
+		self._changes = [] # _PickleTChange not delivered to the observers yet
+		self._hold = 0 # depth of `_collecting` blocks
+		if isinstance(filename, _PickleTSpace): # table of a PickleCatalog
+			self._pk = filename
+		else:
+			self._pk = PickleDB(filename, *args, **kwargs)
+		self._lock = self._pk._lock # one lock for the table and its db
 
 
 
 		self.height = self.get_height()
 
-		self.ids = [h for h in range(self.height)]
+		self.ids = list(range(self.height))
+		self._next_id = self.height # ids are never reused
+		self._id_map = None # row id -> row index, built on demand
+
+		self._load_meta()
+		self._pk.dump_hooks.append(self._dump_meta)
 
 	def __bool__(self):
 		return bool(self.height)
@@ -478,15 +1923,35 @@ class PickleTable:
 	def __iter__(self):
 		return self.rows_obj()
 
+	@_locked
 	def rescan(self):
-		self._pk.rescan()
+		if self._pk.rescan():
+			self._reloaded()
+
+	def _reloaded(self):
+		'''The file was changed from outside, every row index/id is stale now'''
+		self.height = self.get_height()
+		self.ids = list(range(self.height))
+		self._next_id = self.height
+		self._rows_moved()
+		self.gen_CC()
+
+		self._rebuild_indexes()
+
+		self._changes.clear() # their row ids mean nothing now
+		if self._feeds:
+			self._changed("reload")
 
 	def unlink(self):
 		self._pk.unlink()
 
 	def delete_file(self):
+		meta = self._meta_location
 		self._pk.delete_file()
+		if meta and os.path.exists(meta):
+			os.remove(meta)
 
+	@_locked
 	def extend(self, other: "PickleTable"):
 		if other is None:
 			return
@@ -497,20 +1962,23 @@ class PickleTable:
 		if sorted(self.column_names) != sorted(other.column_names):
 			raise ValueError("Both tables must have same column names")
 
-		for row in other:
-			self._add_row(row)
-
-		self.auto_dump()
+		other.rescan()
+		self.add_rows_columnar({c: other._pk.db[c] for c in other.column_names})
 
 
 	def gen_CC(self):
-		self.CC = hash(time.time() + random.random() + time.thread_time())
+		self.CC += 1
 
 		return self.CC
 
 	def get_height(self):
 		self.rescan()
-		h = len(self._pk[self.column_names[0]]) if self.column_names else 0
+		db = self._pk.db
+		if not db:
+			return 0
+
+		first = self.column_names[0]
+		h = db.length(first) if hasattr(db, "length") else len(db[first]) # lazy tables don't decode it
 
 		return h
 
@@ -530,19 +1998,47 @@ class PickleTable:
 		self._pk.set_location(location)
 
 
-	def lock(self, func):
-		def inner(*args, **kwargs):
-
-			while self.busy:
-				time.sleep(.001)
+	@contextmanager
+	def batch(self):
+		'''Group many changes into a single dump (see `PickleDB.transaction`).
+		Row ids and height are rolled back with the data if the block raises.
 
-			self.busy = True
-
-			box = func(*args, **kwargs)
+		ie: with table.batch():
+			row = table.add_row({"login": now})
+			row.update({"active_time": 10})
+		'''
+		catalog = getattr(self._pk, "catalog", None)
+		if catalog is not None:
+			# a rollback restores the whole catalog file, every open table of it must follow
+			with catalog.batch():
+				yield self
+			return
 
-			self.busy = False
+		ids = self.ids.copy()
+		height = self.height
+		try:
+			with self._pk.transaction():
+				yield self
+		except BaseException:
+			if not self._pk._tx_depth: # rolled back
+				self.ids = ids
+				self.height = height
+				self._rows_moved()
+				self._rebuild_indexes()
+				self._changes.clear()
+			raise
+
+		if not self._pk._tx_depth and not self._hold:
+			self._deliver() # the changes of the block, at once
+
+	transaction = batch
 
-			return box
+	def lock(self, func):
+		'''Wrap func to run while holding the table lock'''
+		@functools.wraps(func)
+		def inner(*args, **kwargs):
+			with self._lock:
+				return func(*args, **kwargs)
 
 		return inner
 
@@ -555,51 +2051,215 @@ class PickleTable:
 		'''Return the list pointer to the column (unsafe)'''
 		return self._pk.db[name]
 
+	def dtype(self, name):
+		'''Return the dtype of a typed column ("category" for categorical ones, "ts" for timestamps), None for regular columns'''
+		return getattr(self._pk.db[name], "dtype", None)
+
 	def column_obj(self, name):
 		return _PickleTColumn(self, name, self.CC)
 
-	def columns(self):
-		'''Return a copy list of all columns in db'''
-		self.rescan()
-		return self._pk.db.copy()
-
-	def columns_obj(self):
-		'''Return a list of all columns in db'''
-		self.rescan()
-		return [_PickleTColumn(self, name, self.CC) for name in self._pk.db]
-
-	@property
-	def column_names(self):
+	@_locked
+	def column_array(self, name):
 		"""
-		return a tuple (unmodifiable) of column names
+		Return a copy of the column as a numpy array (requires numpy)
+		Typed columns keep their dtype, numbers with None become float with NaN.
+		Never a view: a column can not grow or shrink while its buffer is exported (BufferError)
 		"""
-		self.rescan()
-		return tuple(self._pk.db.keys())
+		if np is None:
+			raise ImportError("column_array requires numpy (pip install numpy)")
 
-	def add_column(self, *names, exist_ok=False, AD=True):
-		"""
-		name: column name
-		exist_ok: ignore if column already exists. Else raise KeyError
-		AD: auto-dump
-		"""
 		self.rescan()
-		def add(name):
-			self._pk.validate_key(key=name)
+		cells = self._pk.db[name]
 
-			tsize = self.height
-			if name in self.column_names:
-				if exist_ok :
-					tsize = self.height - len(self._pk.db[name])
-					if not tsize: # 0 cells to add
+		if isinstance(cells, _PickleTArray):
+			return np.frombuffer(cells[:], dtype=cells.typecode) # the slice is a plain array.array copy
+
+		arr = np.array(cells)
+		if arr.dtype == object:
+			try:
+				arr = np.array(cells, dtype=float)
+			except (TypeError, ValueError):
+				pass
+		return arr
+
+	@_locked
+	def _numbers(self, name, dropna=True):
+		'''numpy float/int array copy of the column (without the missing values), None if numpy can't help'''
+		if np is None:
+			return None
+
+		cells = self._pk.db[name]
+		if isinstance(cells, _PickleTArray):
+			arr = np.frombuffer(cells[:], dtype=cells.typecode)
+		else:
+			arr = self.column_array(name)
+			if arr.dtype.kind not in "iufb":
+				return None
+
+		if dropna and arr.dtype.kind == "f":
+			arr = arr[~np.isnan(arr)]
+		return arr
+
+	def _values(self, name):
+		'''list of the column values without None/NaN (pure python path)'''
+		return [v for v in self._pk.db[name] if v is not None and v == v]
+
+	@_locked
+	def column_sum(self, name):
+		'''Sum of a numeric column (None/NaN ignored)'''
+		self.rescan()
+		arr = self._numbers(name, dropna=False)
+		if arr is not None:
+			return np.nansum(arr).item()
+		return sum(self._values(name))
+
+	@_locked
+	def column_mean(self, name):
+		'''Mean of a numeric column (None/NaN ignored), None if there is no value'''
+		self.rescan()
+		arr = self._numbers(name)
+		if arr is not None:
+			return arr.mean().item() if len(arr) else None
+		return _mean(self._values(name))
+
+	@_locked
+	def column_percentile(self, name, q):
+		'''q-th percentile (0-100, linear interpolation) of a numeric column, None if there is no value'''
+		self.rescan()
+		arr = self._numbers(name)
+		if arr is not None:
+			return np.percentile(arr, q).item() if len(arr) else None
+
+		values = sorted(self._values(name))
+		if not values:
+			return None
+		pos = (len(values) - 1) * q / 100
+		low = int(pos)
+		high = min(low + 1, len(values) - 1)
+		return values[low] + (values[high] - values[low]) * (pos - low)
+
+	@_locked
+	def histogram(self, name, bins=10, range=None):
+		'''
+		Histogram of a numeric column, returns (counts, bin_edges) lists like numpy.histogram
+		# bins: number of equal width bins
+		# range: (min, max) of the bins, default is the min and max of the column
+		'''
+		self.rescan()
+		arr = self._numbers(name)
+		if arr is not None:
+			counts, edges = np.histogram(arr, bins=bins, range=range)
+			return counts.tolist(), edges.tolist()
+
+		values = self._values(name)
+		low, high = range or ((min(values), max(values)) if values else (0, 1))
+		if low == high:
+			low, high = low - .5, high + .5
+		width = (high - low) / bins
+		edges = [low + width * i for i in builtins.range(bins)] + [high]
+		counts = [0] * bins
+		for v in values:
+			if low <= v <= high:
+				counts[min(int((v - low) / width), bins - 1)] += 1
+		return counts, edges
+
+	@_locked
+	def value_counts(self, name, key=None):
+		'''
+		Return {value: count} of a column, most common first
+		# key: count `key(value)` instead (ie: the day of a date), None cells are skipped
+		'''
+		self.rescan()
+		cells = self._pk.db[name]
+		if key is None and np is not None and isinstance(cells, _PickleTArray):
+			values, counts = np.unique(self._numbers(name), return_counts=True)
+			order = np.argsort(-counts, kind="stable")
+			return dict(zip(values[order].tolist(), counts[order].tolist()))
+
+		if isinstance(cells, _PickleTCategory):
+			if np is not None:
+				counts = np.bincount(np.frombuffer(cells.codes[:], dtype=np.uint32), minlength=len(cells.values)).tolist()
+			else:
+				counts = [0] * len(cells.values)
+				for code in cells.codes:
+					counts[code] += 1
+
+			counter = Counter()
+			for value, n in zip(cells.values, counts):
+				if n and value is not None:
+					counter[value if key is None else key(value)] += n
+			return dict(counter.most_common())
+
+		if key is None:
+			counter = Counter(v for v in cells if v is not None)
+		else:
+			counter = Counter(key(v) for v in cells if v is not None)
+		return dict(counter.most_common())
+
+	def columns(self):
+		'''Return a copy list of all columns in db'''
+		self.rescan()
+		return self._pk.db.copy()
+
+	def columns_obj(self):
+		'''Return a list of all columns in db'''
+		self.rescan()
+		return [_PickleTColumn(self, name, self.CC) for name in self._pk.db]
+
+	@property
+	def column_names(self):
+		"""
+		return a tuple (unmodifiable) of column names
+		"""
+		self.rescan()
+		return tuple(self._pk.db.keys())
+
+	@_locked
+	def add_column(self, *names, exist_ok=False, AD=True, dtype=None):
+		"""
+		name: column name
+		exist_ok: ignore if column already exists. Else raise KeyError
+		AD: auto-dump
+		dtype: store the column in a typed array ("f8", "f4", "i8", "i4", "i2", "i1", "u8", "u4", "u2", "u1")
+			instead of a list of python objects. Existing untyped columns are converted (exist_ok)
+			"category" stores each distinct value once and a small code per cell (repeated strings)
+			"ts" stores int64 epoch seconds (dates given as TIME_FORMAT strings are converted, see `days()`)
+		"""
+		self.rescan()
+		def add(name):
+			self._pk.validate_key(key=name)
+
+			tsize = self.height
+			if name in self.column_names:
+				if exist_ok :
+					if dtype and getattr(self._pk.db[name], "dtype", None) != dtype:
+						self._pk.db[name] = _column(dtype, self._pk.db[name])
+						self._pk._record("set", name, self._pk.db[name])
+						self._touched(0)
+						if name in self._indexes: # it holds the old values
+							self._indexes[name].build(self._pk.db[name], self.ids)
+						for rollup in self._rollups.values():
+							if name in rollup.columns:
+								rollup.build(self._pk.db)
+
+					tsize = self.height - len(self._pk.db[name])
+					if not tsize: # 0 cells to add
 						return
 				else:
 					raise KeyError("Column Name already exists")
 			else:
-				self._pk.db[name] = []
+				self._pk.db[name] = _column(dtype) if dtype else []
+				self._pk._record("set", name, self._pk.db[name])
 				self.gen_CC() # major change
 
 
 			self._pk.db[name].extend([None] * tsize)
+			self._pk._record("extend", name, [None] * tsize)
+
+			index = self._indexes.get(name)
+			if index is not None:
+				for row_id, value in zip(self.ids[self.height - tsize:], self._pk.db[name][self.height - tsize:]):
+					index.add(value, row_id)
 
 		if isinstance(names[0], Iterable) and not isinstance(names[0], str) and not isinstance(names[0], bytes) and len(names) == 1:
 			names = names[0]
@@ -612,6 +2272,7 @@ class PickleTable:
 			self.auto_dump()
 
 
+	@_locked
 	def del_column(self, name, AD=True):
 		"""
 		@ locked
@@ -620,6 +2281,11 @@ class PickleTable:
 		"""
 		self.rescan()
 		self.lock(self._pk.db.pop)(name)
+		self._pk._record("rem", name)
+		self._indexes.pop(name, None)
+		for column, rollup in list(self._rollups.items()):
+			if name in rollup.columns:
+				del self._rollups[column]
 		if not self._pk.db: # has no keys
 			self.height = 0
 
@@ -637,23 +2303,47 @@ class PickleTable:
 		"""
 		self.rescan()
 
-		columns = _columns or self.column_names
-		return {j: self._pk.db[j][row] for j in columns}
+		db = self._pk.db
+		columns = _columns or db.keys() # already rescanned
+		return {j: db[j][row] for j in columns}
 
 	def row_by_id(self, row_id, _columns=()):
 		"""
 		returns a row dict by `row_id`
 		_column: specify columns you need, blank if you need all
 		"""
-		return self.row(self.ids.index(row_id), _columns=_columns)
+		return self.row(self.index_of(row_id), _columns=_columns)
+
+	def _rows_moved(self, row=0):
+		'''Row indexes changed from `row` on (insert, delete, reload), drop the id map and the cached indexes of row/cell objects'''
+		self._id_map = None
+		self._layout += 1
+		self._touched(row)
+
+	def index_of(self, row_id) -> int:
+		'''Return the current row index of `row_id` (raises ValueError like list.index)'''
+		id_map = self._id_map
+		if id_map is None:
+			with self._lock: # rows can't move while the map is built, a stale one is never cached
+				id_map = self._id_map
+				if id_map is None:
+					id_map = self._id_map = {rid: i for i, rid in enumerate(self.ids)}
+
+		try:
+			return id_map[row_id]
+		except KeyError:
+			raise ValueError("{} is not a valid row id".format(row_id)) from None
 
 	def row_obj(self, row):
 		'''Return a row object `_PickleTRow` in db
 		# row: row index
 		'''
+		if row < 0:
+			row += len(self.ids)
 		return _PickleTRow(source=self,
 			uid=self.ids[row],
-			CC=self.CC)
+			CC=self.CC,
+			row=row)
 
 	def row_obj_by_id(self, row_id):
 		'''Return a row object `_PickleTRow` in db
@@ -685,10 +2375,24 @@ class PickleTable:
 			end = self.height + end
 
 
+		# ids are copied, rows can be deleted while looping (the cached indexes are dropped then)
+		rows = range(*slice(start, end, sep).indices(len(self.ids)))
 		ids = self.ids[start:end:sep]
+		CC = self.CC
+		layout = self._layout
+		for row, row_id in zip(rows, ids):
+			yield _PickleTRow(self, row_id, CC, row=row if self._layout == layout else None)
 
-		for id in ids:
-			yield self.row_obj_by_id(id)
+	def rows_tuple(self, start:int=0, end:int=None, sep:int=1, columns=None):
+		'''
+		Yield the rows as tuples of values (column order, or `columns`), no row objects are made.
+		Columns are copied (sliced) first, so changing the table while iterating is fine
+		'''
+		self.rescan()
+
+		db = self._pk.db
+		columns = self.column_names if columns is None else columns
+		return zip(*[db[c][start:end:sep] for c in columns])
 
 
 	def search_iter(self, kw, column=None , row=None, full_match=False, return_obj=True):
@@ -719,6 +2423,21 @@ class PickleTable:
 			return None
 
 		elif column:
+			index = self._indexes.get(column)
+			if index is not None and full_match:
+				for r in sorted(map(self.index_of, index.lookup(kw))):
+					yield ret(col=column, row=r)
+
+				return None
+
+			cells = self._pk.db[column]
+			if isinstance(cells, _PickleTCategory):
+				# check every distinct value once, then only compare the codes
+				for r in cells.positions(cells.codes_where(lambda value: check(kw, value))):
+					yield ret(col=column, row=r)
+
+				return None
+
 			for r, i in enumerate(self.column(column)):
 				if check(kw, i):
 					yield ret(col=column, row=r)
@@ -748,11 +2467,211 @@ class PickleTable:
 		for cell in self.search_iter(kw, column=column , row=row, full_match=full_match, return_obj=return_obj):
 			return cell
 
+	def search_range(self, column, low=None, high=None, return_obj=True):
+		"""
+		search cells of `column` where low <= value < high (None means unbounded)
+		and return the cell objects in loop (in row order).
+		Uses the sorted index of the column if it has one, None cells never match
+
+		ie: for cell in db.search_range("post_date", "2024-01-01", "2024-01-02"):
+			print(cell.value)
+		"""
+		self.rescan()
+
+		if return_obj:
+			ret = self.get_cell_obj
+		else:
+			ret = self.get_cell
+
+		if isinstance(self._pk.db[column], _PickleTTime):
+			low, high = _epoch(low) or 1, _epoch(high) # 0 is not set
+
+		index = self._indexes.get(column)
+		if index is not None and index.kind == "sorted":
+			rows = sorted(map(self.index_of, index.range(low, high)))
+		else:
+			rows = [r for r, v in enumerate(self._pk.db[column])
+				if v is not None and (low is None or v >= low) and (high is None or v < high)]
+
+		for r in rows:
+			yield ret(col=column, row=r)
+
+
+	def query(self) -> "_PickleTQuery":
+		"""
+		Return a query over all rows (see `_PickleTQuery`)
+		"""
+		return _PickleTQuery(self)
 
+	def where(self, column, op="==", value=None) -> "_PickleTQuery":
+		"""
+		Return a query of the rows where `column` matches the condition
+		# op: "==", "!=", "<", "<=", ">", ">=", "in", "contains", "startswith", "day" or a function(cell) -> bool
 
+		ie: table.where("login", "startswith", "2024-01-01").agg(total=("active_time", "sum"))
+		"day" on a "ts" column is answered by its day index: table.where("login", "day", None) # today
+		"""
+		return _PickleTQuery(self).where(column, op, value)
 
+	@_locked
+	def days(self, column) -> dict:
+		"""
+		Return {"YYYY-MM-DD": row count} of a "ts" column (local days, oldest first).
+		Comes from the day index of the column, cells are not parsed
+		"""
+		self.rescan()
+		cells = self._pk.db[column]
+		if not isinstance(cells, _PickleTTime):
+			raise TypeError("days() needs a \"ts\" column, not {!r}".format(column))
 
+		return {datetime.date.fromordinal(day).isoformat(): len(rows) for day, rows in sorted(cells.days().items())}
 
+	@_locked
+	def create_index(self, column, kind="hash", persist=False):
+		"""
+		Create a secondary index on `column` used by full match searches (and range searches for "sorted")
+		# column: column name
+		# kind: "hash" or "sorted"
+		# persist: save the index in `<location>.meta` so it is not rebuilt on next load
+		"""
+		self.rescan()
+
+		if column not in self._pk.db:
+			raise KeyError("Column {} does not exist".format(column))
+
+		index = _PickleTIndex(column, kind=kind, persist=persist)
+		index.build(self._pk.db[column], self.ids)
+		self._indexes[column] = index
+
+		if persist:
+			self._dump_meta()
+
+		return index
+
+	@_locked
+	def create_rollup(self, column, *sums) -> "_PickleTRollup":
+		"""
+		Keep the row count and the totals of `sums` columns per local day of `column`
+		("ts" or date strings), updated on every row change. Reading a day is a dict lookup
+
+		ie: activity = table.create_rollup("login", "active_time")
+			activity.day()["active_time"] # today
+			len(activity) # days with rows
+		Not saved with the file (the wal would make it stale), built again in one pass when the table is opened
+		"""
+		self.rescan()
+
+		for c in (column,) + sums:
+			if c not in self._pk.db:
+				raise KeyError("Column {} does not exist".format(c))
+
+		rollup = self._rollups.get(column)
+		if rollup is not None and rollup.sums == sums: # already there
+			return rollup
+
+		rollup = _PickleTRollup(self, column, sums)
+		rollup.build(self._pk.db)
+		self._rollups[column] = rollup
+
+		return rollup
+
+	def rollup(self, column) -> "_PickleTRollup":
+		'''Return the rollup of `column` (see `create_rollup`), KeyError if there is none'''
+		self.rescan()
+		return self._rollups[column]
+
+	@_locked
+	def drop_rollup(self, column):
+		"""
+		Remove the rollup of `column` (if any)
+		"""
+		self._rollups.pop(column, None)
+
+	@_locked
+	def drop_index(self, column):
+		"""
+		Remove the index of `column` (if any)
+		"""
+		index = self._indexes.pop(column, None)
+		if index is not None and index.persist:
+			self._dump_meta()
+
+	def _rebuild_indexes(self):
+		'''(re)build the indexes and the rollups from the columns'''
+		for column, index in list(self._indexes.items()):
+			if column not in self._pk.db:
+				del self._indexes[column]
+				continue
+			index.build(self._pk.db[column], self.ids)
+
+		for column, rollup in list(self._rollups.items()):
+			if not all(c in self._pk.db for c in rollup.columns):
+				del self._rollups[column]
+				continue
+			rollup.build(self._pk.db)
+
+	@property
+	def _meta_location(self):
+		if self._pk.in_memory:
+			return ""
+		return self._pk.meta_location
+
+	def _dump_meta(self):
+		'''Save persistent indexes next to the db file (runs after each full dump)'''
+		location = self._meta_location
+		if not location:
+			return
+
+		persist = {c: index for c, index in self._indexes.items() if index.persist}
+		if not persist:
+			if os.path.exists(location):
+				os.remove(location)
+			return
+
+		# runs in the dump thread while the writer holds the lock, index_of could wait for it
+		position = {rid: i for i, rid in enumerate(self.ids)}.__getitem__
+		meta = {
+			"sig": self._pk._base_sig(),
+			"indexes": {c: {"kind": index.kind, "entries": index.entries(position)} for c, index in persist.items()},
+		}
+
+		with NamedTemporaryFile(mode='wb', delete=False, dir=os.path.dirname(os.path.abspath(location))) as f:
+			msgpack.dump(meta, f, default=_msgpack_default)
+		os.replace(f.name, location)
+
+	def _load_meta(self):
+		'''Load persistent indexes, entries are only trusted if the db file did not change since they were saved'''
+		location = self._meta_location
+		if not location or not os.path.exists(location):
+			return
+
+		try:
+			with open(location, 'rb') as f:
+				meta = msgpack.load(f)
+		except (OSError, ValueError):
+			logger.warning("Failed to read %s, indexes will be rebuilt", location)
+			return
+
+		valid = (tuple(meta.get("sig", ())) == self._pk._base_sig()
+			and not os.path.exists(self._pk.wal_location))
+
+		for column, info in meta.get("indexes", {}).items():
+			if column not in self._pk.db:
+				continue
+
+			index = _PickleTIndex(column, kind=info["kind"], persist=True)
+			if valid:
+				index.load(info["entries"], self.ids)
+			else:
+				index.build(self._pk.db[column], self.ids)
+			self._indexes[column] = index
+
+
+
+
+
+
+	@_locked
 	def set_cell(self, col, row, val, AD=True):
 		"""
 		# col: column name
@@ -762,7 +2681,32 @@ class PickleTable:
 		"""
 		self.rescan()
 
-		self._pk.db[col][row] = val
+		cells = self._pk.db[col]
+		stored = getattr(cells, "stored", None)
+		if stored is not None:
+			val = stored(val) # converted before the index and rollups let go of the row
+
+		index = self._indexes.get(col)
+		if index is not None:
+			row_id = self.ids[row]
+			index.remove(cells[row], row_id)
+
+		rollups = [rollup for rollup in self._rollups.values() if col in rollup.columns]
+		for rollup in rollups:
+			rollup.remove(self._pk.db, row)
+
+		cells[row] = val
+		self._pk._record("iset", col, row, val)
+		self._touched(row if row >= 0 else row + self.height)
+
+		if index is not None:
+			index.add(val, row_id)
+
+		for rollup in rollups:
+			rollup.add(self._pk.db, row)
+
+		if self._feeds:
+			self._changed("update", self.ids[row], (col,))
 
 		if AD:
 			self.auto_dump()
@@ -774,7 +2718,7 @@ class PickleTable:
 		# val: value of cell
 		# AD: auto dump
 		"""
-		return self.set_cell(col=col, row=self.ids.index(row_id), val=val, AD=AD)
+		return self.set_cell(col=col, row=self.index_of(row_id), val=val, AD=AD)
 
 	def get_cell(self, col, row):
 		"""
@@ -785,7 +2729,7 @@ class PickleTable:
 		return self._pk.db[col][row]
 
 	def get_cell_by_id(self, col, row_id):
-		return self.get_cell(col, self.ids.index(row_id))
+		return self.get_cell(col, self.index_of(row_id))
 
 	def get_cell_obj(self, col, row:int=-1, row_id:int=-1):
 		"""
@@ -796,14 +2740,15 @@ class PickleTable:
 		"""
 
 		if row>-1:
-			return _PickleTCell(self, column=col, row_id=self.ids[row], CC=self.CC)
+			return _PickleTCell(self, column=col, row_id=self.ids[row], CC=self.CC, row=row)
 		if row_id>-1:
-			return _PickleTCell(self, column=col, row_id=self.ids[row], CC=self.CC)
+			return _PickleTCell(self, column=col, row_id=row_id, CC=self.CC)
 
 		# in case row or row_id is invalid
 		raise IndexError("Invalid row")
 
 
+	@_locked
 	def pop_row(self, index:int=-1, returns=True, AD=True):
 		"""
 		index: index of the row (not id), if not given, last row of the table is popped
@@ -815,13 +2760,34 @@ class PickleTable:
 		if returns:
 			box = self.row(index)
 
-		for c in self.column_names:
-			self._pk.db[c].pop(index)
+		row_id = self.ids[index]
+		for rollup in self._rollups.values():
+			rollup.remove(self._pk.db, index)
+
+		columns = tuple(self._pk.db.keys())
+		for c in columns:
+			value = self._pk.db[c].pop(index)
+			self._pk._record("ipop", c, index)
+
+			if c in self._indexes:
+				self._indexes[c].remove(value, row_id)
 
 		self.ids.pop(index)
+		if index < 0:
+			index += len(self.ids) + 1
+		if self._id_map is not None and index == len(self.ids):
+			# last row, others keep their index
+			self._id_map.pop(row_id, None)
+			self._layout += 1
+			self._touched(index)
+		else:
+			self._rows_moved(index)
 
 		self.height -=1
 
+		if self._feeds:
+			self._changed("delete", row_id, columns)
+
 		if AD:
 			self.auto_dump()
 
@@ -838,8 +2804,9 @@ class PickleTable:
 		row_id: unique id of the row
 		AD: auto dump
 		"""
-		self.del_row(self.ids.index(row_id), AD=AD)
+		self.del_row(self.index_of(row_id), AD=AD)
 
+	@_locked
 	def clear(self, AD=True):
 		"""
 		Delete all rows
@@ -848,39 +2815,82 @@ class PickleTable:
 		"""
 		self.rescan()
 
-		for c in self.column_names:
+		deleted = self.ids.copy() if self._feeds else ()
+		columns = tuple(self._pk.db.keys())
+
+		for c in columns:
 			self._pk.db[c].clear()
+			self._pk._record("iclear", c)
 
 		self.ids.clear()
+		self._rows_moved()
+		self._id_map = {}
+
+		for index in self._indexes.values():
+			index.clear()
+		for rollup in self._rollups.values():
+			rollup.clear()
 		self.height = 0
 
+		with self._collecting():
+			for row_id in deleted:
+				self._changed("delete", row_id, columns)
+
 		if AD:
 			self.auto_dump()
 
 
 
+	@_locked
 	def _add_row(self, row:Union[dict, _PickleTRow], position:int="last") -> _PickleTRow:
 		"""
 		# row: row must be a dict or _PickleTRow containing column names and values
 		"""
 		self.rescan()
+		db = self._pk.db
+		columns = tuple(db.keys())
+
+		# convert every value first, a rejected one must not leave the columns misaligned
+		values = []
+		for k in columns:
+			v = row.get(k)
+			if v is not None:
+				cells = db[k]
+				if type(cells) is not list: # typed (None is always fine)
+					v = cells.stored(v)
+			values.append(v)
+
+		row_id = self._next_id
+		self._next_id += 1
 
-
-		if not self.ids:
-			row_id = 0
-		else:
-			row_id = self.ids[-1] + 1
-
+		if isinstance(position, int):
+			if position < 0:
+				position = max(0, len(self.ids) + position)
+			if position >= len(self.ids):
+				position = "last" # same as appending, keeps the id map valid
 
 		if isinstance(position, int):
-			for k in self.column_names:
-				self._pk.db[k].insert(position, row.get(k))
+			for k, v in zip(columns, values):
+				db[k].insert(position, v)
+				self._pk._record("insert", k, position, v)
+				if k in self._indexes:
+					self._indexes[k].add(v, row_id)
 			self.ids.insert(position, row_id)
+			self._rows_moved(position) # every row after position moved
+			for rollup in self._rollups.values():
+				rollup.add(db, position)
 
 		else:
-			for k in self.column_names:
-				self._pk.db[k].append(row.get(k))
+			for k, v in zip(columns, values):
+				db[k].append(v)
+				self._pk._record("append", k, v)
+				if k in self._indexes:
+					self._indexes[k].add(v, row_id)
 			self.ids.append(row_id)
+			if self._id_map is not None:
+				self._id_map[row_id] = len(self.ids) - 1
+			for rollup in self._rollups.values():
+				rollup.add(db, -1)
 
 
 		#for k, v in row.items():
@@ -888,7 +2898,10 @@ class PickleTable:
 
 		self.height += 1
 
-		return self.row_obj_by_id(row_id)
+		if self._feeds: # after the row is fully in, sync observers may read it
+			self._changed("insert", row_id, columns)
+
+		return _PickleTRow(self, row_id, self.CC, row=len(self.ids) - 1 if position == "last" else position)
 
 
 	def add_row(self, row:Union[dict, _PickleTRow], position="last", AD=True) -> _PickleTRow:
@@ -930,6 +2943,151 @@ class PickleTable:
 		return row_obj
 
 
+	def add_rows(self, rows, AD=True) -> list:
+		"""
+		@ locked
+		Append many rows at once (see `add_rows_columnar`), returns the ids of the new rows
+		* rows: iterable of dicts|_PickleTRow (missing columns are None, unknown keys ignored like `add_row`)
+			or a {column: values} dict
+		"""
+		if isinstance(rows, dict):
+			return self.add_rows_columnar(rows, AD=AD)
+
+		with self._lock:
+			self.rescan()
+			rows = rows if isinstance(rows, list) else list(rows)
+			return self.add_rows_columnar({c: [row.get(c) for row in rows] for c in self._pk.db.keys()}, AD=AD)
+
+	@_locked
+	def add_rows_columnar(self, columns:dict, AD=True) -> list:
+		"""
+		Append rows given as {column: values} (values of the same length, missing columns are None).
+		Everything is checked before the table changes, then each column is extended in one call
+		and the table is dumped once. Returns the ids of the new rows
+
+		ie: table.add_rows_columnar({"login": logins, "active_time": times})
+		"""
+		self.rescan()
+		db = self._pk.db
+		staged = self._stage(columns)
+		n = len(next(iter(staged.values()))) if staged else 0
+		if not n:
+			return []
+
+		start = self.height
+		for name in db.keys():
+			cells = db[name]
+			values = staged.get(name)
+			cells.extend([None] * n if values is None else values)
+			added = cells[start:]
+			self._pk._record("extend", name, added.tolist() if isinstance(added, array.array) else added) # as stored
+
+			index = self._indexes.get(name)
+			if index is not None:
+				for row_id, value in zip(range(self._next_id, self._next_id + n), added):
+					index.add(value, row_id)
+
+		ids = range(self._next_id, self._next_id + n)
+		self._next_id += n
+		self.ids.extend(ids)
+		if self._id_map is not None:
+			self._id_map.update(zip(ids, range(start, start + n)))
+		self.height += n
+
+		for rollup in self._rollups.values():
+			for row in range(start, start + n):
+				rollup.add(db, row)
+
+		if self._feeds:
+			names = tuple(db.keys())
+			with self._collecting():
+				for row_id in ids:
+					self._changed("insert", row_id, names)
+
+		if AD:
+			self.auto_dump()
+
+		return list(ids)
+
+	@_locked
+	def update_rows(self, ids, columns:dict, AD=True):
+		"""
+		Set the cells of many rows at once, dumped once
+		* ids: row ids (a repeated id gets its last value)
+		* columns: {column: values} (one value per id, in the same order)
+
+		ie: table.update_rows(ids, {"active_time": times})
+		"""
+		self.rescan()
+		db = self._pk.db
+		ids = list(ids)
+		staged = self._stage(columns, len(ids))
+		if not ids or not staged:
+			return
+
+		last = {row_id: n for n, row_id in enumerate(ids)}
+		if len(last) < len(ids): # repeated ids, the last value wins
+			keep = sorted(last.values())
+			ids = [ids[n] for n in keep]
+			staged = {name: [values[n] for n in keep] for name, values in staged.items()}
+
+		rows = [self.index_of(row_id) for row_id in ids] # ValueError before anything changed
+		changed = tuple(staged)
+
+		rollups = [rollup for rollup in self._rollups.values() if any(c in staged for c in rollup.columns)]
+		for rollup in rollups:
+			for row in rows:
+				rollup.remove(db, row)
+
+		for name, values in staged.items():
+			cells = db[name]
+			index = self._indexes.get(name)
+			for row, row_id, value in zip(rows, ids, values):
+				if index is not None:
+					index.remove(cells[row], row_id)
+				cells[row] = value
+				self._pk._record("iset", name, row, cells[row])
+				if index is not None:
+					index.add(cells[row], row_id)
+
+		for rollup in rollups:
+			for row in rows:
+				rollup.add(db, row)
+
+		self._touched(min(rows))
+
+		if self._feeds:
+			with self._collecting():
+				for row_id in ids:
+					self._changed("update", row_id, changed)
+
+		if AD:
+			self.auto_dump()
+
+	def _stage(self, columns:dict, length=None) -> dict:
+		'''Check bulk {column: values} and convert the values of typed columns, nothing is changed'''
+		db = self._pk.db
+		staged = {}
+		for name, values in columns.items():
+			if name not in db:
+				raise KeyError("Column {} does not exist".format(name))
+
+			cells = db[name]
+			if isinstance(cells, _PickleTArray):
+				values = _column(cells.dtype, values) # converted (and checked) once
+			elif isinstance(cells, _PickleTCategory):
+				values = list(map(cells.stored, values)) # unhashable values raise here
+			elif not isinstance(values, list):
+				values = list(values)
+
+			if length is None:
+				length = len(values)
+			elif len(values) != length:
+				raise ValueError("Column {} has {} values, expected {}".format(name, len(values), length))
+			staged[name] = values
+
+		return staged
+
 	def verify_source(self, CC):
 		return CC == self.CC
 
@@ -942,32 +3100,406 @@ class PickleTable:
 	def dump(self):
 		self._pk.dump()
 
+	def snapshot(self, path, background=True):
+		'''
+		Write a point in time copy of the table to `path` as a regular table file (see `PickleDB.snapshot`).
+		Returns the writing thread if `background`
+		'''
+		self.rescan()
+		return self._pk.snapshot(path, background)
+
+	def flush(self):
+		for export in self._csv_exports.values():
+			export.flush()
+		self._pk.flush()
+
+	def close(self):
+		for export in self._csv_exports.values():
+			export.flush()
+		self._pk.close()
+
 	def auto_dump(self):
 		self._pk._autodumpdb()
 
-	def to_csv(self, filename, write_header=True):
-		with open(filename, "w", newline='', encoding='utf8') as f:
-			writer = csv.writer(f)
+	@_locked
+	def to_csv(self, filename, write_header=True, incremental=False):
+		'''
+		Write the table to a csv file
+		# incremental: only write what changed since the last incremental export to the same file
+			(new rows are appended, the file is truncated at the first changed row and written from there).
+			The whole file is written if the columns changed or someone else touched the file
+		'''
+		self.rescan()
+		if not incremental:
+			_PickleTCSV(self, filename).write(write_header, incremental=False)
+			return
+
+		self._csv_export(filename).write(write_header)
+
+	def export_csv(self, filename, interval=1.0, write_header=True):
+		'''
+		Incremental `to_csv` in the background, at most once every `interval` seconds.
+		Calls in between are merged into that one write. flush(), close() and exit write what is pending
+		'''
+		export = self._csv_export(filename)
+		export.flush_interval = interval
+		export.write_header = write_header
+		export.pending = True
+		_Flusher.get().schedule(export)
+
+	def on_change(self, callback, columns=None, mode="sync", interval=0.05, kinds=("insert", "update", "delete")) -> "_PickleTFeed":
+		'''
+		Call `callback(changes)` with the batches of row changes of the table (list of `_PickleTChange`),
+		one batch per table call or per `batch()` block (rolled back blocks deliver nothing).
+		Returns the observer, close() it to stop
+		# columns: only updates of these columns (None for all)
+		# mode: "sync" calls back in the thread that changed the table, once the call is done (the table lock is still held),
+			"queue" queues the changes and calls back from the background writer thread, at most every `interval` seconds
+		# kinds: change kinds to deliver, "reload" (file changed from outside, start over) is always delivered
+
+		ie: table.on_change(lambda changes: table.export_csv("table.csv"))
+		'''
+		feed = _PickleTFeed(self, callback, kinds, columns=columns, mode=mode, interval=interval)
+		with self._lock:
+			self._feeds.append(feed)
+		return feed
+
+	def on_insert(self, callback, mode="sync", interval=0.05) -> "_PickleTFeed":
+		'''`on_change` for the new rows only'''
+		return self.on_change(callback, mode=mode, interval=interval, kinds=("insert",))
+
+	def on_update(self, callback, columns=None, mode="sync", interval=0.05) -> "_PickleTFeed":
+		'''`on_change` for the changed cells only (of `columns`, None for all)'''
+		return self.on_change(callback, columns=columns, mode=mode, interval=interval, kinds=("update",))
+
+	def on_delete(self, callback, mode="sync", interval=0.05) -> "_PickleTFeed":
+		'''`on_change` for the deleted rows only'''
+		return self.on_change(callback, mode=mode, interval=interval, kinds=("delete",))
+
+	def _changed(self, kind, row_id=None, columns=()):
+		'''Queue a change for the observers, delivered at the end of the table call / batch'''
+		changes = self._changes
+		last = changes[-1] if changes else None
+		if kind == "update" and last is not None and last.kind == "update" and last.row_id == row_id:
+			if columns[0] not in last.columns: # row.update() of many columns: one change
+				last.columns += columns
+		else:
+			changes.append(_PickleTChange(kind, row_id, columns))
+
+		if not self._hold and not self._pk._tx_depth:
+			self._deliver()
+
+	def _deliver(self):
+		changes, self._changes = self._changes, []
+		if not changes:
+			return
+		for feed in self._feeds.copy():
+			try:
+				feed.push(changes)
+			except Exception:
+				logger.exception("--change observer of %s failed--", self._pk.location)
+
+	@contextmanager
+	def _collecting(self):
+		'''Deliver the changes made in the block as one batch at the end of it'''
+		with self._lock:
+			self._hold += 1
+			try:
+				yield
+			finally:
+				self._hold -= 1
+				if not self._hold and not self._pk._tx_depth:
+					self._deliver()
+
+	def _csv_export(self, filename):
+		key = os.path.abspath(filename)
+		export = self._csv_exports.get(key)
+		if export is None:
+			export = self._csv_exports[key] = _PickleTCSV(self, filename)
+		return export
+
+	def _touched(self, row):
+		'''Rows from `row` on changed, incremental csv exports rewrite them'''
+		for export in self._csv_exports.values():
+			if export.dirty_from is None or row < export.dirty_from:
+				export.dirty_from = row
+
+	def _arrow_column(self, name):
+		'''pyarrow array of a column (typed and categorical columns are converted without python objects if numpy is there)'''
+		cells = self._pk.db[name]
+		if isinstance(cells, _PickleTTime):
+			if np is not None:
+				arr = np.array(cells, dtype=np.int64) # copy, arrow could keep the column buffer exported
+				return pa.array(arr, type=pa.timestamp("s"), mask=arr == 0)
+			return pa.array([v or None for v in cells], type=pa.timestamp("s"))
+
+		if isinstance(cells, _PickleTArray):
+			if np is not None:
+				# NaN is how typed float columns store None
+				return pa.array(np.frombuffer(cells[:], dtype=cells.typecode), from_pandas=True) # copy, arrow could keep the buffer
+			return pa.array([None if v != v else v for v in cells])
+
+		if isinstance(cells, _PickleTCategory):
+			if np is not None:
+				codes = np.frombuffer(cells.codes[:], dtype=np.uint32).astype(np.int32)
+				indices = pa.array(codes, mask=codes == 0)
+			else:
+				indices = pa.array([c or None for c in cells.codes], type=pa.int32())
+			values = cells.values.copy()
+			values[0] = values[1] if len(values) > 1 else "" # code 0 (None) is masked out
+			return pa.DictionaryArray.from_arrays(indices, _arrow_values(values))
+
+		return _arrow_values(cells)
+
+	def to_arrow(self, filename=None, chunk_size=64*1024):
+		'''
+		Return the table as a pyarrow.Table, or write it to an Arrow IPC file if `filename` is given
+		(requires pyarrow). Built straight from the columns, no rows are made
+		# chunk_size: rows per record batch in the file
+		'''
+		if pa is None:
+			raise ImportError("to_arrow requires pyarrow (pip install pyarrow)")
+
+		with self._lock:
+			self.rescan()
+			table = pa.table({name: self._arrow_column(name) for name in self.column_names})
+
+		if filename is None:
+			return table
+
+		with pa.OSFile(filename, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+			for batch in table.to_batches(max_chunksize=chunk_size):
+				writer.write_batch(batch)
+
+	def to_parquet(self, filename, chunk_size=64*1024, compression="snappy"):
+		'''
+		Write the table to a parquet file (requires pyarrow)
+		# chunk_size: rows per row group
+		# compression: parquet codec ("snappy", "zstd", "gzip", None...)
+		'''
+		table = self.to_arrow()
+		pq.write_table(table, filename, row_group_size=chunk_size, compression=compression)
+
+	def to_ndjson(self, filename, chunk_size=1024):
+		'''
+		Write the table as newline delimited json, one object per row (stdlib only).
+		NaN and unset "ts" cells become null, "ts" cells are TIME_FORMAT strings like in csv,
+		values json does not know are written as str
+		# chunk_size: rows per write
+		'''
+		with self._lock:
+			self.rescan()
+			columns = self.column_names
+			times = [self._pk.db[c].format if isinstance(self._pk.db[c], _PickleTTime) else None for c in columns]
+			rows = self.rows_tuple(columns=columns) # columns are copied, the lock is not needed after this
+
+		dumps = json.JSONEncoder(ensure_ascii=False, default=str).encode
+		with open(filename, "w", encoding="utf8", newline="\n") as f:
+			lines = []
+			for row in rows:
+				lines.append(dumps({c: (fmt(v) or None) if fmt else None if v != v else v for c, v, fmt in zip(columns, row, times)}))
+				if len(lines) >= chunk_size:
+					f.write("\n".join(lines) + "\n")
+					lines.clear()
+			if lines:
+				f.write("\n".join(lines) + "\n")
+
+
+
+
+class _PickleTCSV:
+	"""
+	Incremental csv export of a table to one file (see `PickleTable.to_csv(incremental=True)`).
+	Remembers the byte offset of every written row, so the file is only
+	truncated at the first changed row and written from there
+	"""
+	def __init__(self, source:PickleTable, filename):
+		self.source = source
+		self.location = filename
+		self.write_header = True
+		self.flush_interval = 1.0 # export_csv() delay
+		self.pending = False # waiting on the flusher
+
+		self.columns = None # header of the file, None if it was never written
+		self.offsets = [] # where every row starts + the end of the file
+		self.dirty_from = None # first row changed since the last write
+		self.stat = None # (size, mtime) of the file after the last write
+
+	def _start(self, columns, write_header):
+		'''First row to write, None if the whole file has to be written'''
+		if self.columns != columns or self.write_header != write_header:
+			return None
+		try:
+			st = os.stat(self.location)
+		except FileNotFoundError:
+			return None
+		if (st.st_size, st.st_mtime_ns) != self.stat: # changed by someone else
+			return None
+
+		rows = len(self.offsets) - 1
+		return rows if self.dirty_from is None else min(rows, self.dirty_from)
+
+	def write(self, write_header=True, incremental=True):
+		'''Write the file (the table lock must be held)'''
+		columns = self.source.column_names
+		start = self._start(columns, write_header) if incremental else None
+
+		lines = []
+		writer = csv.writer(types.SimpleNamespace(write=lines.append)) # one write() per row
+		if start is None:
 			if write_header:
-				writer.writerow(self.column_names) # header
-			for row in self.rows():
-				writer.writerow([row[k] for k in self.column_names])
+				writer.writerow(columns) # header
+			offsets = [len(lines[0].encode("utf8")) if write_header else 0]
+			header = len(lines)
+		else:
+			offsets = self.offsets[:start + 1]
+			header = 0
+
+		db = self.source._pk.db
+		times = [(n, db[c].format) for n, c in enumerate(columns) if isinstance(db[c], _PickleTTime)]
+		for row in self.source.rows_tuple(start=start or 0, columns=columns):
+			if times: # TIME_FORMAT strings, like the dates were before "ts" columns
+				row = list(row)
+				for n, fmt in times:
+					row[n] = fmt(row[n])
+			writer.writerow(row)
+
+		data = [line.encode("utf8") for line in lines]
+		for chunk in data[header:]:
+			offsets.append(offsets[-1] + len(chunk))
+
+		with open(self.location, "wb" if start is None else "r+b") as f:
+			if start is not None:
+				f.seek(offsets[start])
+				f.truncate()
+				data = data[header:]
+			f.writelines(data)
+
+		st = os.stat(self.location)
+		self.stat = (st.st_size, st.st_mtime_ns)
+		self.columns = columns
+		self.write_header = write_header
+		self.offsets = offsets
+		self.dirty_from = None
+		self.pending = False
+
+	def _flush_pending(self):
+		with self.source._lock:
+			if self.pending:
+				self.write(self.write_header)
+
+	def flush(self):
+		if _Flusher._instance is not None:
+			_Flusher._instance.cancel(self)
+		self._flush_pending()
+
+
+class _PickleTChange:
+	"""
+	One row change delivered to the observers of a table (see `PickleTable.on_change`)
+	# kind: "insert", "update", "delete" or "reload" (the file was changed from outside, row_id is None: start over)
+	# row_id: unique id of the row
+	# columns: changed columns (every column for insert/delete)
+	"""
+	__slots__ = ("kind", "row_id", "columns")
+
+	def __init__(self, kind, row_id=None, columns=()):
+		self.kind = kind
+		self.row_id = row_id
+		self.columns = columns
+
+	def __repr__(self):
+		return "{}({!r}, {!r}, {!r})".format(type(self).__name__, self.kind, self.row_id, self.columns)
+
+
+class _PickleTFeed:
+	"""
+	One observer of the changes of a table (see `PickleTable.on_change`)
+	Changes are delivered in batches: everything done by one table call (or one `batch()` block) at once
+	"""
+	modes = ("sync", "queue")
+
+	def __init__(self, source:PickleTable, callback, kinds, columns=None, mode="sync", interval=0.05):
+		if mode not in self.modes:
+			raise ValueError("mode must be one of {}".format(self.modes))
+
+		self.source = source
+		self.callback = callback
+		self.kinds = frozenset(kinds) | {"reload"}
+		self.columns = None if columns is None else frozenset(columns)
+		self.mode = mode
+
+		self.flush_interval = interval # queue mode delay
+		self.pending = [] # queue mode, waiting on the flusher
+		self._pending_lock = Lock()
 
+	@property
+	def location(self):
+		return self.source._pk.location
+
+	def push(self, changes):
+		'''Deliver the changes this observer wants (the table lock is held)'''
+		columns = self.columns
+		changes = [c for c in changes if c.kind in self.kinds
+			and (columns is None or c.kind != "update" or not columns.isdisjoint(c.columns))]
+		if not changes:
+			return
+
+		if self.mode == "sync":
+			self.callback(changes)
+			return
 
+		with self._pending_lock:
+			self.pending.extend(changes)
+		_Flusher.get().schedule(self)
+
+	def _flush_pending(self):
+		with self._pending_lock:
+			changes, self.pending = self.pending, []
+		if changes:
+			self.callback(changes)
+
+	def flush(self):
+		'''Deliver the queued changes now'''
+		if _Flusher._instance is not None:
+			_Flusher._instance.cancel(self)
+		self._flush_pending()
+
+	def close(self):
+		'''Stop observing (queued changes are still delivered)'''
+		with self.source._lock:
+			if self in self.source._feeds:
+				self.source._feeds.remove(self)
+		self.flush()
 
 
 class _PickleTCell:
-	def __init__(self, source:PickleTable, column, row_id:int, CC):
+	"""
+	Handle of one cell (row id + column name), the row index is cached until rows move (see `PickleTable._layout`)
+	"""
+	__slots__ = ("source", "id", "column_name", "CC", "_pos", "_layout")
+
+	def __init__(self, source:PickleTable, column, row_id:int, CC, row:int=None):
 		self.source = source
 		self.id = row_id
 		self.column_name = column
 		self.CC = CC
+		self._pos = row # row index, if the caller knows it
+		self._layout = -1 if row is None else source._layout
+
+	def _row(self):
+		source = self.source
+		if self._layout != source._layout:
+			self._pos = source.index_of(self.id)
+			self._layout = source._layout
+		return self._pos
 
 	@property
 	def value(self):
+		self.source.rescan()
 		self.source_check()
 
-		return self.source.get_cell_by_id(self.column_name, self.id)
+		return self.source._pk.db[self.column_name][self._row()]
 
 	def __str__(self):
 		return str({
@@ -1012,14 +3544,15 @@ class _PickleTCell:
 		"""
 		self.source_check()
 
-		self.source.set_cell_by_id(self.column_name, self.id, val=value, AD=AD)
+		with self.source._lock: # the row can't move between finding it and writing it
+			self.source.set_cell(self.column_name, self._row(), val=value, AD=AD)
 
 
 	@property
 	def row(self):
 		self.source_check()
 
-		return self.source.ids.index(self.id)
+		return self._row()
 
 	def row_obj(self):
 		"""
@@ -1027,7 +3560,7 @@ class _PickleTCell:
 		"""
 		self.source_check()
 
-		return self.source.row_obj_by_id(row_id=self.id)
+		return _PickleTRow(self.source, self.id, self.CC, row=self._row())
 
 	@property
 	def column(self):
@@ -1045,19 +3578,36 @@ class _PickleTCell:
 		"""Clear the cell value"""
 		self.source_check()
 
-		self.source.set_cell_by_id(self.column_name, self.id, None)
+		with self.source._lock:
+			self.source.set_cell(self.column_name, self._row(), None)
+
 
+class _PickleTRow:
+	"""
+	Handle of one row (row id), reads and writes go straight to the columns.
+	The row index is cached until rows move (see `PickleTable._layout`)
+	"""
+	__slots__ = ("source", "id", "CC", "_pos", "_layout")
 
-class _PickleTRow(dict):
-	def __init__(self, source:PickleTable, uid, CC):
+	def __init__(self, source:PickleTable, uid, CC, row:int=None):
 		self.source = source
 		self.id = uid
 		self.CC = CC
+		self._pos = row # row index, if the caller knows it
+		self._layout = -1 if row is None else source._layout
+
+	def _row(self):
+		source = self.source
+		if self._layout != source._layout:
+			self._pos = source.index_of(self.id)
+			self._layout = source._layout
+		return self._pos
 
 	def __getitem__(self, name):
+		self.source.rescan()
 		self.source.raise_source(self.CC)
 
-		return self.source.get_cell_by_id(name, self.id)
+		return self.source._pk.db[name][self._row()]
 
 	def to_dict(self):
 		"""
@@ -1075,37 +3625,56 @@ class _PickleTRow(dict):
 		if name not in self.source.column_names:
 			return default
 
-		return self.source.get_cell_obj(col=name, row_id=self.id)
+		return _PickleTCell(self.source, name, self.id, self.CC, row=self._row())
 
 	def __setitem__(self, name, value):
 		# Auto dumps
 		self.source.raise_source(self.CC)
 
-		self.source.set_cell(name, self.source.ids.index(self.id), value)
+		with self.source._lock: # the row can't move between finding it and writing it
+			self.source.set_cell(name, self._row(), value)
 
 	def __delitem__(self, name):
 		# Auto dump
 		self.source.raise_source(self.CC)
 
-		self.source.set_cell(name, self.source.ids.index(self.id), None)
+		with self.source._lock:
+			self.source.set_cell(name, self._row(), None)
+
+	def __contains__(self, name):
+		return name in self.source.column_names
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.source.column_names)
+
+	def __eq__(self, other):
+		if isinstance(other, _PickleTRow):
+			return self.source is other.source and self.id == other.id
+		if isinstance(other, dict):
+			return self.to_dict() == other
+		return NotImplemented
 
 	def index(self):
 		"""
 		returns the current index of the row
 		"""
-		return self.source.ids.index(self.id)
+		return self._row()
 
 	def update(self, new:Union[dict, "_PickleTRow"], ignore_extra=False, AD=True):
 		"""
 		Auto dumps
 		"""
 
-		for k, v in new.items():
-			try:
-				self.source.set_cell(k, self.source.ids.index(self.id), v, AD=False)
-			except KeyError:
-				if not ignore_extra:
-					raise
+		with self.source._collecting(): # one change for all the columns
+			for k, v in new.items():
+				try:
+					self.source.set_cell(k, self._row(), v, AD=False)
+				except KeyError:
+					if not ignore_extra:
+						raise
 
 		if AD:
 			self.source.auto_dump()
@@ -1116,6 +3685,9 @@ class _PickleTRow(dict):
 	def keys(self):
 		return self.source.column_names
 
+	def values(self):
+		return [self[k] for k in self.keys()]
+
 	def items(self):
 		for k in self.keys():
 			yield (k, self[k])
@@ -1124,7 +3696,449 @@ class _PickleTRow(dict):
 		# Auto dumps
 		self.source.raise_source(self.CC)
 
-		self.source.del_row_id(self.id)
+		with self.source._lock:
+			self.source.del_row(self._row())
+
+
+class _PickleTIndex:
+	"""
+	Secondary index of a table column, maps cell values to the ids of the rows holding them
+	# kind: "hash" for full match lookups,
+		"sorted" for full match and range lookups (values must be comparable with each other, None is kept aside)
+	"""
+	kinds = ("hash", "sorted")
+
+	def __init__(self, column, kind="hash", persist=False):
+		if kind not in self.kinds:
+			raise ValueError("Index kind must be one of {}".format(self.kinds))
+
+		self.column = column
+		self.kind = kind
+		self.persist = persist
+
+		self.map = {} # value -> set of row ids
+		self.keys = [] # distinct values in order (sorted index only)
+
+	def __len__(self):
+		return len(self.map)
+
+	@staticmethod
+	def _key(value):
+		# NaN (missing value of float columns) != NaN, keep it with None
+		return None if value != value else value
+
+	def add(self, value, row_id):
+		value = self._key(value)
+		ids = self.map.get(value)
+		if ids is None:
+			ids = self.map[value] = set()
+			if self.kind == "sorted" and value is not None:
+				bisect.insort(self.keys, value)
+		ids.add(row_id)
+
+	def remove(self, value, row_id):
+		value = self._key(value)
+		ids = self.map.get(value)
+		if ids is None:
+			return
+
+		ids.discard(row_id)
+		if not ids:
+			del self.map[value]
+			if self.kind == "sorted" and value is not None:
+				del self.keys[bisect.bisect_left(self.keys, value)]
+
+	def lookup(self, value):
+		'''Return the ids of the rows having `value`'''
+		return self.map.get(self._key(value), ())
+
+	def range(self, low=None, high=None):
+		'''Yield the ids of the rows where low <= value < high'''
+		keys = self.keys
+		start = 0 if low is None else bisect.bisect_left(keys, low)
+		end = len(keys) if high is None else bisect.bisect_left(keys, high)
+
+		for key in keys[start:end]:
+			yield from self.map[key]
+
+	def prefix(self, value):
+		'''Yield the ids of the rows where the (string) value starts with `value`'''
+		keys = self.keys
+		if keys and not isinstance(keys[0], str): # ie: "ts" column
+			return
+		for i in range(bisect.bisect_left(keys, value), len(keys)):
+			if not keys[i].startswith(value):
+				break
+			yield from self.map[keys[i]]
+
+	def clear(self):
+		self.map = {}
+		self.keys = []
+
+	def build(self, values, ids):
+		'''(re)build the index from the column values and the row ids in the same order'''
+		self.clear()
+		for value, row_id in zip(values, ids):
+			value = self._key(value)
+			bucket = self.map.get(value)
+			if bucket is None:
+				bucket = self.map[value] = set()
+			bucket.add(row_id)
+
+		self._sort_keys()
+
+	def _sort_keys(self):
+		if self.kind == "sorted":
+			self.keys = sorted(k for k in self.map if k is not None)
+
+	def entries(self, index_of):
+		'''Return [value, [row indexes]] pairs (to save the index)'''
+		return [[value, [index_of(i) for i in ids]] for value, ids in self.map.items()]
+
+	def load(self, entries, ids):
+		'''Load the index from `entries` (see `entries()`), `ids` maps row indexes to row ids'''
+		self.map = {value: {ids[r] for r in rows} for value, rows in entries}
+		self._sort_keys()
+
+
+class _PickleTRollup:
+	"""
+	Row count and column totals per local day of a table, updated on every row change
+	so reading them does not scan the rows (see `PickleTable.create_rollup`)
+	# column: date column ("ts" or date strings), rows where it is not set are left out
+	# sums: columns to total (None/NaN ignored)
+	"""
+	def __init__(self, source:PickleTable, column, sums=()):
+		self.source = source
+		self.column = column
+		self.sums = tuple(sums)
+
+		self.days = {} # local date ordinal -> [row count, total of each sum column]
+		self.totals = [0] * (len(self.sums) + 1) # same for all the days
+
+	@property
+	def columns(self):
+		return (self.column,) + self.sums
+
+	def _totals(self, totals):
+		return dict(zip(("count",) + self.sums, totals))
+
+	def __len__(self):
+		'''number of days having rows'''
+		self.source.rescan()
+		return len(self.days)
+
+	def day(self, day=None) -> dict:
+		'''{"count": rows, <sum column>: total} of `day` (date, "YYYY-MM-DD", timestamp or None for today)'''
+		self.source.rescan()
+		return self._totals(self.days.get(_day_ordinal(day), [0] * len(self.totals)))
+
+	def total(self) -> dict:
+		'''Same as `day` for all the rows'''
+		self.source.rescan()
+		return self._totals(self.totals)
+
+	def items(self) -> dict:
+		'''{"YYYY-MM-DD": totals of the day} oldest first'''
+		self.source.rescan()
+		return {datetime.date.fromordinal(day).isoformat(): self._totals(totals) for day, totals in sorted(self.days.items())}
+
+	def add(self, db, row, sign=1):
+		'''Count row `row` of the columns in (-1 to take it out)'''
+		value = db[self.column][row]
+		if not value or value != value: # None, NaN or 0 ("ts" not set)
+			return
+
+		day = _day_ordinal(value)
+		totals = self.days.get(day)
+		if totals is None:
+			totals = self.days[day] = [0] * len(self.totals)
+
+		for n, column in enumerate(self.columns):
+			value = 1 if not n else db[column][row]
+			if value is not None and value == value:
+				totals[n] += sign * value
+				self.totals[n] += sign * value
+
+		if not totals[0]:
+			del self.days[day]
+
+	def remove(self, db, row):
+		self.add(db, row, -1)
+
+	def clear(self):
+		self.days = {}
+		self.totals = [0] * (len(self.sums) + 1)
+
+	def build(self, db):
+		'''(re)build from the columns'''
+		self.clear()
+		cells = db[self.column]
+		if isinstance(cells, _PickleTTime):
+			groups = cells.days() # day index of the column
+		else:
+			groups = {}
+			for r, value in enumerate(cells):
+				if value and value == value:
+					groups.setdefault(_day_ordinal(value), []).append(r)
+
+		for day, rows in groups.items():
+			totals = self.days[day] = [len(rows)]
+			for column in self.sums:
+				values = db[column]
+				totals.append(sum(v for v in map(values.__getitem__, rows) if v is not None and v == v))
+
+		for totals in self.days.values():
+			for n, value in enumerate(totals):
+				self.totals[n] += value
+
+
+class _PickleTQuery:
+	"""
+	Lazy query on a PickleTable. Runs directly on the column lists (no row objects),
+	conditions are AND-ed and use the column indexes when there are any.
+	Every method returns a new query, so a query can be reused
+
+	ie: q = table.where("login", "startswith", "2024-01-01")
+		q.count()
+		q.agg(total=("active_time", "sum"), longest=("active_time", "max"))
+		table.query().group_by("login", key=lambda s: s[:10]).agg(total=("active_time", "sum"))
+	"""
+	ops = {
+		"==": operator.eq,
+		"!=": operator.ne,
+		# None cells never match an ordering
+		"<": lambda cell, value: cell is not None and cell < value,
+		"<=": lambda cell, value: cell is not None and cell <= value,
+		">": lambda cell, value: cell is not None and cell > value,
+		">=": lambda cell, value: cell is not None and cell >= value,
+		"in": lambda cell, value: cell in value,
+		"contains": lambda cell, value: cell is not None and value in cell,
+		"startswith": lambda cell, value: isinstance(cell, str) and cell.startswith(value),
+		# local day of a timestamp or TIME_FORMAT string, value: date, "YYYY-MM-DD" or None for today
+		"day": lambda cell, value: bool(cell) and cell == cell and _day_ordinal(cell) == _day_ordinal(value),
+	}
+
+	def __init__(self, source:PickleTable, conditions=(), columns=()):
+		self.source = source
+		self.conditions = tuple(conditions) # (column, op, value)
+		self.columns = tuple(columns) # selected columns, blank for all
+
+	def where(self, column, op="==", value=None) -> "_PickleTQuery":
+		'''Add a condition (see `PickleTable.where`)'''
+		if not callable(op) and op not in self.ops:
+			raise ValueError("Unknown operator {!r}".format(op))
+
+		return _PickleTQuery(self.source, self.conditions + ((column, op, value),), self.columns)
+
+	def select(self, *columns) -> "_PickleTQuery":
+		'''Only return `columns` from `rows()`'''
+		return _PickleTQuery(self.source, self.conditions, columns)
+
+	def _test(self, op, value):
+		if callable(op):
+			return op
+
+		op = self.ops[op]
+		return lambda cell: op(cell, value)
+
+	def _from_index(self, column, op, value):
+		'''Return the matching row ids using an index, None if no index can answer it'''
+		index = self.source._indexes.get(column)
+		if index is None or callable(op):
+			return None
+
+		if op == "==":
+			return index.lookup(value)
+
+		if index.kind != "sorted" or value is None:
+			return None
+
+		if op == ">=":
+			return index.range(value, None)
+		if op == "<":
+			return index.range(None, value)
+		if op == ">":
+			return (i for i in index.range(value, None) if i not in index.lookup(value))
+		if op == "<=":
+			return (*index.range(None, value), *index.lookup(value))
+		if op == "startswith" and isinstance(value, str):
+			return index.prefix(value)
+
+		return None
+
+	def positions(self) -> list:
+		'''Return the indexes of the matching rows (in row order)'''
+		with self.source._lock: # rows can not move while they are matched
+			return self._positions()
+
+	def _positions(self) -> list:
+		source = self.source
+		source.rescan()
+		db = source._pk.db
+
+		conditions = list(self.conditions)
+		positions = None
+
+		for n, (column, op, value) in enumerate(conditions):
+			if isinstance(db[column], _PickleTTime) and op in ("==", "!=", "<", "<=", ">", ">="):
+				value = _epoch(value) # compare dates given as strings
+				if op in ("<", "<="): # 0 (not set) is not before anything
+					test = self.ops[op]
+					op = lambda cell, test=test, value=value: cell != 0 and test(cell, value)
+				conditions[n] = (column, op, value)
+
+		for n, (column, op, value) in enumerate(conditions):
+			if op == "day" and isinstance(db[column], _PickleTTime):
+				positions = db[column].on_day(value).copy() # day index, no parsing
+				del conditions[n]
+				break
+
+			ids = self._from_index(column, op, value)
+			if ids is not None:
+				positions = sorted(map(source.index_of, ids))
+				del conditions[n]
+				break
+
+		for column, op, value in conditions:
+			test = self._test(op, value)
+			cells = db[column]
+			if isinstance(cells, _PickleTCategory):
+				codes = cells.codes_where(test)
+				if positions is None:
+					positions = cells.positions(codes)
+				else:
+					positions = [r for r in positions if cells.codes[r] in codes]
+				continue
+
+			if positions is None:
+				positions = [r for r, cell in enumerate(cells) if test(cell)]
+			else:
+				positions = [r for r in positions if test(cells[r])]
+
+		if positions is None: # no conditions
+			positions = list(range(source.height))
+
+		return positions
+
+	def ids(self) -> list:
+		'''Return the ids of the matching rows'''
+		ids = self.source.ids
+		return [ids[r] for r in self.positions()]
+
+	def count(self) -> int:
+		return len(self.positions())
+
+	def column(self, name) -> list:
+		'''Return the values of `name` in the matching rows'''
+		cells = self.source._pk.db[name]
+		return [cells[r] for r in self.positions()]
+
+	def rows(self):
+		'''Yield the matching rows as dict'''
+		db = self.source._pk.db
+		columns = self.columns or tuple(db.keys())
+		cells = [db[c] for c in columns]
+
+		for r in self.positions():
+			yield {c: col[r] for c, col in zip(columns, cells)}
+
+	def first(self):
+		'''Return the first matching row as dict, None if nothing matched'''
+		for row in self.rows():
+			return row
+
+	def group_by(self, column, key=None) -> "_PickleTGroupBy":
+		'''Group the matching rows by the value of `column` (or by `key(value)`)'''
+		return _PickleTGroupBy(self, column, key)
+
+	def agg(self, **specs) -> dict:
+		'''
+		Aggregate the matching rows
+		* specs: name=(column, func) or name=(column, func, key)
+			func: "sum", "count", "min", "max", "mean", "nunique", "first", "last", "list" or a function(values)
+			key: applied on each value before aggregating (ie: to get the day of a date)
+		None cells are ignored
+		'''
+		return _aggregate(self.source._pk.db, self.positions(), specs)
+
+
+class _PickleTGroupBy:
+	"""
+	Groups of a `_PickleTQuery` (see `_PickleTQuery.group_by`)
+	"""
+	def __init__(self, query:_PickleTQuery, column, key=None):
+		self.query = query
+		self.column = column
+		self.key = key
+
+	def groups(self) -> dict:
+		'''Return {group: [row indexes]} in order of first appearance'''
+		cells = self.query.source._pk.db[self.column]
+		key = self.key
+		groups = {}
+		for r in self.query.positions():
+			g = cells[r] if key is None else key(cells[r])
+			rows = groups.get(g)
+			if rows is None:
+				groups[g] = [r]
+			else:
+				rows.append(r)
+
+		return groups
+
+	def keys(self) -> list:
+		return list(self.groups())
+
+	def __len__(self):
+		return len(self.groups())
+
+	def count(self) -> dict:
+		return {g: len(rows) for g, rows in self.groups().items()}
+
+	def agg(self, **specs) -> dict:
+		'''Return {group: {name: value}} (see `_PickleTQuery.agg`)'''
+		db = self.query.source._pk.db
+		return {g: _aggregate(db, rows, specs) for g, rows in self.groups().items()}
+
+
+def _arrow_values(values):
+	'''pyarrow array of a list of python values, mixed types are written as str'''
+	try:
+		return pa.array(values, from_pandas=True)
+	except (pa.ArrowInvalid, pa.ArrowTypeError):
+		return pa.array([None if v is None else str(v) for v in values])
+
+def _mean(values):
+	return sum(values) / len(values) if values else None
+
+_AGGREGATES = {
+	"sum": sum,
+	"count": len,
+	"min": lambda values: min(values) if values else None,
+	"max": lambda values: max(values) if values else None,
+	"mean": _mean,
+	"nunique": lambda values: len(set(values)),
+	"first": lambda values: values[0] if values else None,
+	"last": lambda values: values[-1] if values else None,
+	"list": list,
+}
+
+def _aggregate(db, positions, specs):
+	result = {}
+	for name, spec in specs.items():
+		column, func, *key = spec
+		cells = db[column]
+		values = [cells[r] for r in positions]
+		values = [v for v in values if v is not None and v == v] # skip None and NaN
+		if key and key[0] is not None:
+			values = [key[0](v) for v in values]
+
+		if not callable(func):
+			func = _AGGREGATES[func]
+		result[name] = func(values)
+
+	return result
 
 
 class _PickleTColumn(list):
@@ -1228,8 +4242,9 @@ class _PickleTColumn(list):
 		# This will Set all cells in column to `None`
 		"""
 
-		for row in range(self.source.height):
-			self.source.set_cell(col=self.name, row=row, val=None, AD=False)
+		with self.source._collecting():
+			for row in range(self.source.height):
+				self.source.set_cell(col=self.name, row=row, val=None, AD=False)
 
 		self.source.auto_dump()
 
@@ -1256,6 +4271,359 @@ class _PickleTColumn(list):
 
 
 
+# ---------------- CATALOG ----------------
+# every table of a catalog lives in one PickleDB, column `c` of table `t` is stored under the key "t/c"
+# (wal records use the same keys, so they replay on the flat db as they are)
+
+_CATALOG_KEY = "\0catalog" # marks a catalog file (can't clash with "table/column" keys)
+
+class _PickleTSpaceColumns:
+	"""
+	dict-like view of the columns of one catalog table (what `PickleTable._pk.db` is for a regular table).
+	Always goes through `store.db`, so reloads and rolled back transactions are seen at once
+	"""
+	def __init__(self, store, prefix):
+		self.store = store
+		self.prefix = prefix
+		self._names = None # column names in order, valid while the store db is `self._names_of`
+		self._names_of = None
+
+	def names(self):
+		db = self.store.db
+		if self._names_of is not db:
+			n = len(self.prefix)
+			self._names = [k[n:] for k in db.keys() if k.startswith(self.prefix)]
+			self._names_of = db
+		return self._names
+
+	def length(self, name):
+		'''len() of a column without decoding it'''
+		db = self.store.db
+		key = self.prefix + name
+		return db.length(key) if isinstance(db, _LazyDB) else len(db[key])
+
+	def __getitem__(self, name):
+		return self.store.db[self.prefix + name]
+
+	def __setitem__(self, name, value):
+		names = self.names()
+		if name not in names:
+			names.append(name)
+		self.store.db[self.prefix + name] = value
+
+	def __delitem__(self, name):
+		del self.store.db[self.prefix + name]
+		self.names().remove(name)
+
+	def __contains__(self, name):
+		return self.prefix + name in self.store.db
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.names())
+
+	def keys(self):
+		return self.names().copy()
+
+	def values(self):
+		return [self[name] for name in self.names()]
+
+	def items(self):
+		return [(name, self[name]) for name in self.names()]
+
+	def get(self, name, default=None):
+		return self[name] if name in self else default
+
+	_marker = object()
+	def pop(self, name, default=_marker):
+		if name not in self:
+			if default is self._marker:
+				raise KeyError(name)
+			return default
+		value = self[name]
+		del self[name]
+		return value
+
+	def clear(self):
+		for name in self.keys():
+			del self[name]
+
+	def copy(self):
+		return dict(self.items())
+
+
+class _PickleTSpace:
+	"""
+	Stands in for the PickleDB of a catalog table (`PickleTable._pk`),
+	everything is forwarded to the shared catalog db with the keys prefixed by "<table>/"
+	"""
+	def __init__(self, store, name, catalog=None):
+		self.store = store
+		self.name = name
+		self.catalog = catalog # the PickleCatalog, batches roll back all of its tables
+		self.prefix = name + "/"
+		self.db = _PickleTSpaceColumns(store, self.prefix)
+		self._lock = store._lock
+		self._loads = store._loads # store reloads this table has seen
+
+		self.dump_hooks = []
+		store.dump_hooks.append(self._run_dump_hooks)
+
+	def _run_dump_hooks(self):
+		for hook in self.dump_hooks:
+			hook()
+
+	def rescan(self):
+		'''True if the catalog file was reloaded since the last call (by any table)'''
+		self.store.rescan()
+		if self._loads != self.store._loads:
+			self._loads = self.store._loads
+			return True
+		return False
+
+	def _record(self, op, key=None, *args):
+		self.store._record(op, self.prefix + key, *args)
+
+	def validate_key(self, key):
+		self.store.validate_key(key)
+
+	def _autodumpdb(self):
+		self.store._autodumpdb()
+
+	def transaction(self):
+		return self.store.transaction()
+
+	def snapshot(self, path, background=True):
+		'''Write this table alone as a regular table file (see `PickleDB.snapshot`)'''
+		with self._lock:
+			db = _fork(self.db)
+		return self.store._snapshot(db, path, background)
+
+	@property
+	def _tx_depth(self):
+		return self.store._tx_depth
+
+	def dump(self):
+		return self.store.dump()
+
+	def flush(self):
+		return self.store.flush()
+
+	def close(self):
+		return self.store.close()
+
+	def _base_sig(self):
+		return self.store._base_sig()
+
+	@property
+	def in_memory(self):
+		return self.store.in_memory
+
+	@property
+	def location(self):
+		return self.store.location
+
+	@property
+	def wal_location(self):
+		return self.store.wal_location
+
+	@property
+	def meta_location(self):
+		return "{}.{}.meta".format(self.store.location, self.name)
+
+	@property
+	def dump_stats(self):
+		return self.store.dump_stats
+
+	def unlink(self):
+		raise TypeError("catalog tables live in the catalog file, copy them with PickleTable.to_csv or import_file")
+
+	set_location = unlink
+
+	@_locked
+	def delete_file(self):
+		'''Drop the table from the catalog'''
+		for name in self.db.keys():
+			self.db.pop(name)
+			self._record("rem", name)
+		self._autodumpdb()
+
+
+class PickleCatalog:
+	"""
+	Many named PickleTables in one db file. The tables share the file, its lock, wal,
+	rescan policy and async flusher, and one batch() can change several of them at once.
+	Tables work exactly like regular PickleTables (they just don't have a file of their own)
+
+	ie: catalog = PickleCatalog("../data/accounts.pdb", wal=True)
+		videos = catalog.table(email)
+		times = catalog.table(email + "_time")
+		with catalog.batch(): # one dump for both
+			videos.add_row({"video": path})
+			times.add_row({"login": now})
+	"""
+	def __init__(self, location="", *args, **kwargs):
+		'''location and the other arguments are the ones of `PickleDB`'''
+		self._pk = PickleDB(location, *args, **kwargs)
+		self._lock = self._pk._lock
+		self._tables = {} # name -> PickleTable
+
+		if not self._pk.in_memory and _CATALOG_KEY not in self._pk.db:
+			self._pk.db[_CATALOG_KEY] = 1
+			self._pk._record("set", _CATALOG_KEY, 1)
+
+	@staticmethod
+	def is_catalog(location):
+		'''True if the db file at location is a catalog (not a single table)'''
+		try:
+			return read_column(location, _CATALOG_KEY) == 1
+		except KeyError:
+			return False
+
+	@property
+	def location(self):
+		return self._pk.location
+
+	def tables(self) -> list:
+		'''Names of the tables in the catalog (tables without any column are not stored)'''
+		names = {}
+		for key in self._pk.db.keys():
+			name, sep, _ = key.partition("/")
+			if sep:
+				names[name] = None
+		for name, table in self._tables.items():
+			if table._pk.db.names():
+				names[name] = None
+		return list(names)
+
+	@_locked
+	def digests(self) -> dict:
+		'''
+		{table name: hex digest of its stored columns}, changes when the data of that table does
+		(ie: to skip exporting the tables that did not change). Columns still encoded are not decoded
+		'''
+		self._pk.rescan()
+		db = self._pk.db
+		hashes = {}
+		for key in db.keys():
+			name, sep, _ = key.partition("/")
+			if not sep:
+				continue
+
+			blob = db.raw(key) if isinstance(db, _LazyDB) else None
+			if blob is None: # decoded (ie: changed by the wal)
+				blob = _packb(db[key])
+
+			h = hashes.get(name)
+			if h is None:
+				h = hashes[name] = hashlib.blake2b(digest_size=16)
+			h.update(key.encode() + b"\0")
+			h.update(blob)
+		return {name: h.hexdigest() for name, h in hashes.items()}
+
+	@_locked
+	def table(self, name) -> "PickleTable":
+		'''Return the table `name`, created (empty) if it does not exist'''
+		if not isinstance(name, str) or not name or "/" in name or name == _CATALOG_KEY:
+			raise ValueError("Table name must be a non empty string without '/'")
+
+		table = self._tables.get(name)
+		if table is None:
+			table = self._tables[name] = PickleTable(_PickleTSpace(self._pk, name, self))
+		return table
+
+	__getitem__ = table
+
+	def __contains__(self, name):
+		return name in self.tables()
+
+	def __iter__(self):
+		return iter(self.tables())
+
+	@_locked
+	def drop_table(self, name):
+		'''Delete the table and all its columns'''
+		self.table(name).delete_file()
+		self._tables.pop(name, None)
+
+	@_locked
+	def import_file(self, location, name=None, exist_ok=False):
+		'''
+		Copy a regular table file (and its wal, if any) into the catalog, returns the new table
+		# name: table name, default is the file name without extension
+		# exist_ok: replace the table if it already exists. Else raise KeyError
+		'''
+		if name is None:
+			name = os.path.splitext(os.path.basename(location))[0]
+		if name in self:
+			if not exist_ok:
+				raise KeyError("Table {!r} already exists".format(name))
+			self.drop_table(name)
+
+		source = PickleDB(location, auto_dump=False, sig=False, lazy=False)
+		table = self.table(name)
+		with self._pk.transaction():
+			for column, cells in source.db.items():
+				table._pk.db[column] = cells
+				table._pk._record("set", column, cells)
+		table._reloaded()
+		return table
+
+	@contextmanager
+	def batch(self):
+		'''Group changes to any of the tables into a single dump (see `PickleDB.transaction`),
+		everything is rolled back if the block raises'''
+		saved = {name: (table.ids.copy(), table.height, table._next_id) for name, table in self._tables.items()}
+		try:
+			with self._pk.transaction():
+				yield self
+		except BaseException:
+			if not self._pk._tx_depth: # rolled back
+				for name, table in self._tables.items():
+					if name in saved:
+						table.ids, table.height, table._next_id = saved[name]
+						table._rows_moved()
+						table._rebuild_indexes()
+						table._changes.clear()
+					else: # opened inside the block
+						table._reloaded()
+			raise
+
+		if not self._pk._tx_depth:
+			for table in list(self._tables.values()):
+				if not table._hold:
+					table._deliver()
+
+	transaction = batch
+
+	def rescan(self):
+		return self._pk.rescan()
+
+	def dump(self):
+		return self._pk.dump()
+
+	def snapshot(self, path, background=True):
+		'''
+		Write a point in time copy of every table to `path` (a catalog file, see `PickleDB.snapshot`).
+		All tables are captured at once under the shared lock, so they are consistent with each other.
+		Returns the writing thread if `background`
+		'''
+		return self._pk.snapshot(path, background)
+
+	def flush(self):
+		for table in self._tables.values():
+			table.flush()
+		return self._pk.flush()
+
+	def close(self):
+		for table in self._tables.values():
+			table.flush()
+		return self._pk.close()
+
+
+
 
 
 if __name__ == "__main__":
@@ -1346,6 +4714,479 @@ if __name__ == "__main__":
 		tb.to_csv("test.csv")
 
 
+	def test_catalog_batch():
+		'''A rolled back table batch restores every table of the catalog written in the block'''
+		catalog = PickleCatalog("__test_catalog.pdb", wal=True)
+		videos, times = catalog.table("a@x"), catalog.table("a@x_time")
+		videos.add_column("video", exist_ok=True)
+		times.add_column("login", exist_ok=True, dtype="ts")
+		videos.add_row({"video": "v0"})
+		times.add_row({"login": "2024-01-01"})
+
+		try:
+			with videos.batch():
+				videos.add_row({"video": "v1"})
+				times.add_row({"login": "2024-01-02"})
+				raise KeyError("roll back")
+		except KeyError:
+			pass
+
+		for table in (videos, times):
+			assert table.height == 1 == len(table.get_column(table.column_names[0])), table
+			assert len(list(table.rows())) == 1
+		times.add_row({"login": "2024-01-03"}) # still usable
+		assert list(times.column("login")) == [_epoch("2024-01-01"), _epoch("2024-01-03")]
+
+		catalog.flush()
+		reopened = PickleCatalog("__test_catalog.pdb", wal=True)
+		assert reopened.table("a@x").height == 1 and reopened.table("a@x_time").height == 2
+		print("catalog batch rollback: ok")
+
+
+	def bench_rows():
+		"""
+		rows() walks every row id, so it must stay linear as the table grows
+		(time per row should not grow with the height)
+		"""
+		print("\n rows() benchmark")
+		print("="*50)
+		for n in (10_000, 20_000, 40_000, 80_000):
+			tb = PickleTable()
+			tb.add_column("login", "active_time", AD=False)
+			for i in range(n):
+				tb._add_row({"login": i, "active_time": i/3})
+
+			st = time.perf_counter()
+			for _ in tb.rows():
+				pass
+			et = time.perf_counter()
+
+			# old path, list.index for every id (only on the smaller tables, it's quadratic)
+			old = "-"
+			if n <= 20_000:
+				ost = time.perf_counter()
+				for row_id in tb.ids:
+					tb.row(tb.ids.index(row_id))
+				old = f"{(time.perf_counter() - ost)/n*1e6:.2f}us/row"
+
+			print(f"{n:>8} rows: {et-st:.3f}s  {(et-st)/n*1e6:.2f}us/row  (ids.index: {old})")
+
+
+	def bench_typed():
+		"""
+		dump/load time and file size of a 1M float column, list vs typed array
+		"""
+		print("\n typed column benchmark (1M floats)")
+		print("="*50)
+		values = [random.random() * 3600 for _ in range(1_000_000)]
+		for dtype in (None, "f8"):
+			tb = PickleTable("__bench.pdb")
+			tb.add_column("active_time", dtype=dtype, AD=False)
+			tb._pk.db["active_time"].extend(values)
+
+			st = time.perf_counter()
+			tb.dump()
+			dt = time.perf_counter() - st
+
+			st = time.perf_counter()
+			PickleTable("__bench.pdb")
+			lt = time.perf_counter() - st
+
+			print(f"{dtype or 'list':>5}: dump {dt:.3f}s  load {lt:.3f}s  size {os.path.getsize('__bench.pdb')/1e6:.1f}MB")
+			tb.delete_file()
+
+
+	def bench_stats():
+		"""
+		column statistics on a 1M row table, python loops vs the column helpers (numpy when installed)
+		"""
+		n = 1_000_000
+		print(f"\n column statistics benchmark ({n:,} rows, numpy={'yes' if np is not None else 'no'})")
+		print("="*50)
+		tb = PickleTable()
+		tb.add_column("post_date", AD=False)
+		tb.add_column("active_time", dtype="f8", AD=False)
+		tb._pk.db["active_time"].extend(random.random() * 3600 for _ in range(n))
+		tb._pk.db["post_date"].extend(f"2024-01-{random.randint(1, 28):02d} 10:00:00" for _ in range(n))
+		tb.height = n
+
+		col = tb.get_column("active_time")
+		cases = (
+			("sum", lambda: sum(col), lambda: tb.column_sum("active_time")),
+			("mean", lambda: sum(col) / len(col), lambda: tb.column_mean("active_time")),
+			("p90", lambda: sorted(col)[int(n * .9)], lambda: tb.column_percentile("active_time", 90)),
+			("per day", lambda: Counter(date.split(" ")[0] for date in tb.get_column("post_date")),
+				lambda: tb.value_counts("post_date", key=lambda date: date[:10])),
+		)
+		for name, python_path, helper in cases:
+			st = time.perf_counter()
+			python_path()
+			pt = time.perf_counter() - st
+
+			st = time.perf_counter()
+			helper()
+			ht = time.perf_counter() - st
+			print(f"{name:>8}: python {pt:.4f}s  helper {ht:.4f}s  ({pt/ht:.1f}x)")
+
+
+	def bench_lazy():
+		"""
+		open a wide table and read one column, lazy vs full decode
+		"""
+		print("\n lazy load benchmark (20 columns x 100k rows)")
+		print("="*50)
+		tb = PickleTable("__bench.pdb")
+		tb.add_column(*[f"c{i}" for i in range(20)], AD=False)
+		for name in tb.column_names:
+			tb._pk.db[name].extend(Lower_string(12) for _ in range(100_000))
+		tb.dump()
+
+		for lazy in (False, True):
+			st = time.perf_counter()
+			PickleTable("__bench.pdb", lazy=lazy).get_column("c3")
+			print(f"lazy={lazy!s:>5}: open + 1 column {time.perf_counter() - st:.3f}s")
+		tb.delete_file()
+
+
+	def bench_mmap():
+		"""
+		open a 20 column table and sum one typed column, read() vs mmap (python heap peak and time)
+		"""
+		import tracemalloc
+
+		print("\n mmap load benchmark (20 f8 columns x 500k rows)")
+		print("="*50)
+		tb = PickleTable("__bench.pdb")
+		tb.add_column(*[f"c{i}" for i in range(20)], dtype="f8", AD=False)
+		for name in tb.column_names:
+			tb._pk.db[name].extend(random.random() for _ in range(500_000))
+		tb.dump()
+		print(f"file size {os.path.getsize('__bench.pdb')/1e6:.1f}MB")
+		del tb
+
+		for use_mmap in (False, True):
+			tracemalloc.start()
+			st = time.perf_counter()
+			PickleTable("__bench.pdb", use_mmap=use_mmap).column_sum("c3")
+			et = time.perf_counter()
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+			print(f"use_mmap={use_mmap!s:>5}: {et-st:.3f}s  peak {peak/1e6:.1f}MB")
+
+		os.remove("__bench.pdb")
+
+
+	def bench_async():
+		"""
+		1000 auto dumped add_row on a 50k row table, sync vs async_dump
+		"""
+		print("\n async dump benchmark (1000 writes on 50k rows)")
+		print("="*50)
+		for async_dump in (False, True):
+			tb = PickleTable("__bench.pdb", async_dump=async_dump)
+			tb.add_column("x", "y", AD=False)
+			tb._pk.db["x"].extend(range(50_000))
+			tb._pk.db["y"].extend(Lower_string(12) for _ in range(50_000))
+			tb._reloaded()
+			tb.dump()
+
+			st = time.perf_counter()
+			for n in range(1000):
+				tb.add_row({"x": n, "y": "z"})
+			wt = time.perf_counter()
+			tb.close()
+			et = time.perf_counter()
+			print(f"async_dump={async_dump!s:>5}: writes {wt-st:.3f}s  + flush {et-wt:.3f}s")
+			assert PickleTable("__bench.pdb").height == 51_000
+			tb.delete_file()
+
+
+	def bench_durability():
+		"""
+		dump latency of a 20k row table per durability level
+		"""
+		print("\n durability benchmark (100 dumps of 20k rows)")
+		print("="*50)
+		for durability in PickleDB.durabilities:
+			tb = PickleTable("__bench.pdb", durability=durability)
+			tb.add_column("x", "y", AD=False)
+			tb._pk.db["x"].extend(range(20_000))
+			tb._pk.db["y"].extend(Lower_string(12) for _ in range(20_000))
+
+			for _ in range(100):
+				tb.dump()
+
+			stats = tb._pk.dump_stats
+			print(f"{durability:>4}: mean {stats['total']/stats['count']*1000:.2f}ms  max {stats['max']*1000:.2f}ms")
+			tb.delete_file()
+
+
+	def bench_compress():
+		"""
+		file size, dump and load time of a 100k row table with repetitive strings per codec
+		"""
+		print("\n compression benchmark (100k rows: login time, video path, f8 column)")
+		print("="*50)
+		days = [f"2024-01-{d:02d}" for d in range(1, 31)]
+		videos = [f"../videos/{Lower_string(8)}.mp4" for _ in range(200)]
+
+		codecs = [None, "zlib", "lzma"]
+		if zstandard is not None:
+			codecs.append("zstd")
+		if lz4 is not None:
+			codecs.append("lz4")
+
+		for compression in codecs:
+			for dict_encode in (False, True):
+				tb = PickleTable("__bench.pdb", compression=compression, dict_encode=dict_encode)
+				tb.add_column("login", "video", AD=False)
+				tb.add_column("active_time", dtype="f8", AD=False)
+				tb._pk.db["login"].extend(f"{random.choice(days)} {random.randrange(24):02d}:00" for _ in range(100_000))
+				tb._pk.db["video"].extend(random.choice(videos) for _ in range(100_000))
+				tb._pk.db["active_time"].extend(random.random() * 3600 for _ in range(100_000))
+
+				st = time.perf_counter()
+				tb.dump()
+				dt = time.perf_counter()
+				PickleTable("__bench.pdb", lazy=False)
+				lt = time.perf_counter()
+				print(f"{compression or 'none':>4} dict_encode={dict_encode!s:>5}: {os.path.getsize('__bench.pdb')/1e6:6.2f}MB  dump {dt-st:.3f}s  load {lt-dt:.3f}s")
+				tb.delete_file()
+
+
+	def bench_category():
+		"""
+		200k rows of 50 distinct long strings, list vs category column (memory, equality search)
+		"""
+		import tracemalloc
+
+		print("\n category benchmark (200k rows, 50 distinct paths)")
+		print("="*50)
+		videos = [f"../videos/{Lower_string(40)}.mp4" for _ in range(50)]
+		cells = [random.choice(videos) for _ in range(200_000)]
+
+		for dtype in (None, "category"):
+			tracemalloc.start()
+			tb = PickleTable("__bench.pdb", lazy=False)
+			tb.add_column("video", AD=False, dtype=dtype)
+			tb._pk.db["video"].extend(cells)
+			tb._reloaded()
+			tb.dump()
+			del tb
+
+			tb = PickleTable("__bench.pdb", lazy=False)
+			mem = tracemalloc.get_traced_memory()[0]
+			tracemalloc.stop()
+
+			st = time.perf_counter()
+			for video in videos[:10]:
+				tb.where("video", "==", video).count()
+			qt = time.perf_counter()
+			for video in videos[:10]:
+				tb.find_1st(video, column="video", full_match=True)
+				sum(1 for _ in tb.search_iter(video, column="video", full_match=True, return_obj=False))
+			et = time.perf_counter()
+			print(f"{dtype or 'list':>8}: {mem/1e6:.1f}MB  10 where() {qt-st:.3f}s  10 search_iter {et-qt:.3f}s")
+			tb.delete_file()
+
+
+	def bench_handles():
+		"""
+		read one column of every row: row objects vs rows() dicts vs rows_tuple()
+		"""
+		print("\n row handle benchmark (100k rows)")
+		print("="*50)
+		tb = PickleTable("", auto_dump=False)
+		tb.add_column("x", "y", "z", AD=False)
+		for n in range(100_000):
+			tb._add_row({"x": n, "y": "a", "z": None})
+
+		st = time.perf_counter()
+		total = sum(row["x"] for row in tb.rows_obj())
+		ot = time.perf_counter()
+		assert total == sum(row["x"] for row in tb.rows())
+		dt = time.perf_counter()
+		assert total == sum(x for x, y, z in tb.rows_tuple())
+		tt = time.perf_counter()
+		print(f"rows_obj {ot-st:.3f}s  rows {dt-ot:.3f}s  rows_tuple {tt-dt:.3f}s  ({sys.getsizeof(tb[0])} bytes/row object)")
+
+
+	def bench_csv():
+		"""
+		export after every one of 500 new rows on a 20k row table: full vs incremental to_csv
+		"""
+		print("\n csv export benchmark (20k rows + 500 single row exports)")
+		print("="*50)
+		for incremental in (False, True):
+			tb = PickleTable("", auto_dump=False)
+			tb.add_column("login", AD=False)
+			tb.add_column("active_time", dtype="f8", AD=False)
+			for n in range(20_000):
+				tb._add_row({"login": Lower_string(19), "active_time": n})
+			tb.to_csv("__bench.csv", incremental=incremental)
+
+			st = time.perf_counter()
+			for n in range(500):
+				tb._add_row({"login": Lower_string(19), "active_time": n})
+				tb.to_csv("__bench.csv", incremental=incremental)
+			print(f"incremental={incremental!s:>5}: {time.perf_counter()-st:.3f}s")
+		os.remove("__bench.csv")
+
+
+	def bench_ts():
+		"""
+		"today" total and distinct days over 200k logins (a year): date strings vs "ts" column day index
+		"""
+		print("\n timestamp benchmark (200k rows, 20 checks)")
+		print("="*50)
+		start = time.time() - 365*86400
+		logins = [start + n * 365*86400 / 200_000 for n in range(200_000)]
+		today = time.strftime("%Y-%m-%d")
+		for dtype in (None, "ts"):
+			tb = PickleTable("", auto_dump=False)
+			tb.add_column("login", dtype=dtype, AD=False)
+			tb.add_column("active_time", dtype="f8", AD=False)
+			for n, login in enumerate(logins):
+				tb._add_row({"login": time.strftime(TIME_FORMAT, time.localtime(login)), "active_time": n})
+
+			st = time.perf_counter()
+			for _ in range(20):
+				if dtype:
+					total = tb.where("login", "day", None).agg(total=("active_time", "sum"))["total"]
+					days = len(tb.days("login"))
+				else:
+					total = tb.where("login", "startswith", today).agg(total=("active_time", "sum"))["total"]
+					days = len(tb.query().group_by("login", key=lambda login: login.split(" ")[0]).groups())
+			print(f"{dtype or 'str':>4}: {time.perf_counter()-st:.3f}s  ({days} days, today {total:.0f})")
+
+
+	def bench_rollup():
+		"""
+		the 3 checks of a warm up (today total, days, total time) on 100k logins: query scans vs rollup
+		"""
+		print("\n rollup benchmark (100k rows, 100 rounds of checks + 1 new row each)")
+		print("="*50)
+		start = time.time() - 365*86400
+		for rollup in (False, True):
+			tb = PickleTable("", auto_dump=False)
+			tb.add_column("login", dtype="ts", AD=False)
+			tb.add_column("active_time", dtype="f8", AD=False)
+			for n in range(100_000):
+				tb._add_row({"login": start + n * 365*86400 / 100_000, "active_time": 1})
+			activity = tb.create_rollup("login", "active_time") if rollup else None
+
+			st = time.perf_counter()
+			for _ in range(100):
+				row = tb._add_row({"login": time.time(), "active_time": 0})
+				row.update({"active_time": 10}, AD=False)
+				if rollup:
+					today, days, total = activity.day()["active_time"], len(activity), activity.total()["active_time"]
+				else:
+					today = tb.where("login", "day", None).agg(total=("active_time", "sum"))["total"]
+					days = len(tb.days("login"))
+					total = tb.query().agg(total=("active_time", "sum"))["total"]
+			print(f"rollup={rollup!s:>5}: {time.perf_counter()-st:.3f}s  ({days} days, today {today:.0f}, total {total:.0f})")
+
+
+	def bench_snapshot():
+		"""
+		500k row table: how long writers are blocked by a dump vs by a background snapshot
+		"""
+		print("\n snapshot benchmark (500k rows, 3 columns)")
+		print("="*50)
+		tb = PickleTable("__bench.pdb", auto_dump=False)
+		tb.add_column("login", "video", AD=False)
+		tb.add_column("active_time", dtype="f8", AD=False)
+		for n in range(500_000):
+			tb._add_row({"login": Lower_string(19), "video": Lower_string(10), "active_time": n})
+
+		st = time.perf_counter()
+		tb.dump()
+		print(f"    dump: {time.perf_counter()-st:.3f}s blocked")
+
+		st = time.perf_counter()
+		thread = tb.snapshot("__bench.snap.pdb")
+		blocked = time.perf_counter() - st
+		thread.join()
+		print(f"snapshot: {blocked:.3f}s blocked, {time.perf_counter()-st:.3f}s to write")
+		tb.delete_file()
+		os.remove("__bench.snap.pdb")
+
+
+	def bench_bulk():
+		"""
+		load 1M rows (login ts, active_time f8, video str): add_row loop vs add_rows vs add_rows_columnar, + one dump
+		"""
+		print("\n bulk insert benchmark (1M rows)")
+		print("="*50)
+		n = 1_000_000
+		start = time.time() - 365*86400
+		logins = [start + i * 30 for i in range(n)]
+		times = [float(i % 3600) for i in range(n)]
+		videos = [Lower_string(10) for _ in range(n // 100)] * 100
+
+		def table():
+			tb = PickleTable("__bench.pdb", auto_dump=False)
+			tb.add_column("login", dtype="ts", AD=False)
+			tb.add_column("active_time", dtype="f8", AD=False)
+			tb.add_column("video", AD=False)
+			return tb
+
+		for how in ("add_row", "add_rows", "add_rows_columnar"):
+			tb = table()
+			st = time.perf_counter()
+			if how == "add_row": # 1/5 of the rows, it takes too long
+				for i in range(n // 5):
+					tb.add_row({"login": logins[i], "active_time": times[i], "video": videos[i]}, AD=False)
+			elif how == "add_rows":
+				tb.add_rows([{"login": l, "active_time": t, "video": v} for l, t, v in zip(logins, times, videos)], AD=False)
+			else:
+				tb.add_rows_columnar({"login": logins, "active_time": times, "video": videos}, AD=False)
+			took = time.perf_counter() - st
+			if how == "add_row":
+				print(f"{how:>17}: {took * 5:.2f}s for 1M rows (from 200k)")
+				continue
+			st = time.perf_counter()
+			tb.dump()
+			print(f"{how:>17}: {took:.2f}s for 1M rows, dump {time.perf_counter()-st:.2f}s")
+			tb.delete_file()
+
+		tb = table()
+		ids = tb.add_rows_columnar({"login": logins, "active_time": times, "video": videos}, AD=False)
+		st = time.perf_counter()
+		for row_id in ids[:n // 5]:
+			tb.set_cell_by_id("active_time", row_id, 1.0, AD=False)
+		single = (time.perf_counter() - st) * 5
+		st = time.perf_counter()
+		tb.update_rows(ids, {"active_time": [1.0] * n}, AD=False)
+		print(f"  update 1M cells: set_cell_by_id {single:.2f}s (from 200k), update_rows {time.perf_counter()-st:.2f}s")
+
+
+	benches = {
+		"test": None,
+		"rows": bench_rows,
+		"typed": bench_typed,
+		"stats": bench_stats,
+		"lazy": bench_lazy,
+		"mmap": bench_mmap,
+		"async": bench_async,
+		"durability": bench_durability,
+		"compress": bench_compress,
+		"category": bench_category,
+		"handles": bench_handles,
+		"csv": bench_csv,
+		"ts": bench_ts,
+		"rollup": bench_rollup,
+		"snapshot": bench_snapshot,
+		"bulk": bench_bulk,
+	}
+
+	# python pyroDB.py [test|rows|typed|stats|lazy|mmap|async|durability|compress|category|handles|csv|ts|rollup|snapshot|bulk]
+	run = sys.argv[1] if len(sys.argv) > 1 else "test"
+	if benches[run] is not None:
+		benches[run]()
+		sys.exit()
+
 # if __name__ == "__main__":
 	for i in range(1):
 		try:
@@ -1354,4 +5195,12 @@ if __name__ == "__main__":
 			pass
 		test()
 		os.remove("__test.pdb")
+
+		for f in ("__test_catalog.pdb", "__test_catalog.pdb.wal"):
+			if os.path.exists(f):
+				os.remove(f)
+		test_catalog_batch()
+		for f in ("__test_catalog.pdb", "__test_catalog.pdb.wal"):
+			if os.path.exists(f):
+				os.remove(f)
 		print("\n\n\n" + "# "*25 + "\n")